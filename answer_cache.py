@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+from threading import Lock
+from typing import Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+# 去掉空白和结尾的语气、标点，“今天几号？”“今天几号啊”视为同一个问题
+_SPACE = re.compile(r"\s+")
+_TAIL = re.compile(r"[呀啊~～。.!！?？,，…]+$")
+
+# 按会话保存模式等状态的模型：同一个问题在不同会话、不同模式下回答不同，不管 skip 怎么配置都不共用
+STATEFUL = {"chatglm"}
+
+
+def normalize(question: str) -> str:
+    q = unicodedata.normalize("NFKC", question).lower()
+    return _TAIL.sub("", _SPACE.sub("", q))
+
+
+class AnswerCache(object):
+    """模型回答缓存
+    同一模型、归一化后相同的问题，在 ttl 内直接复用之前的回答；
+    同时在问的相同问题只调用一次模型，其余的等它的回答（single-flight）。
+    有对话记录的会话由调用方传入 session，回答只在同一会话、记录没变时共用。
+    不想共用回答的模型放在 skip 里（STATEFUL 里的总是跳过）；多模型路由时按实际回答的模型判断。
+    # 开头的是命令（如 ChatGLM 的 #1 切换模式），每次都要交给模型执行，不缓存。
+    调用方只缓存真正的回答：模型出错时 fetch 要返回空或抛出异常，不能返回错误信息。
+    """
+
+    def __init__(self, conf: dict = None) -> None:
+        """
+        :param conf: config.yaml 的 answer_cache 配置
+        """
+        conf = conf or {}
+        self.LOG = logging.getLogger("AnswerCache")
+        self.enable = conf.get("enable", True)
+        self.ttl = conf.get("ttl", 300)
+        self.max_size = max(1, int(conf.get("max_size", 1000)))
+        self.max_chars = conf.get("max_chars", 100)
+        self.skip = STATEFUL | {str(name).lower() for name in conf.get("skip") or []}
+        self.wait = conf.get("wait", 120)
+        self._answers: OrderedDict = OrderedDict()  # key -> (回答, 过期时间)，按写入时间排序
+        self._flights: Dict[Tuple, Future] = {}  # key -> 正在调用模型的结果
+        self._lock = Lock()
+        self.hits = 0
+        self.coalesced = 0
+        self.misses = 0
+
+    def key(self, backend: str, question: str, persona: Optional[str] = None,
+            session: Optional[Hashable] = None) -> Optional[Tuple]:
+        """缓存键，不缓存时返回 None
+        :param persona: 会话的人设，人设不同回答也不同
+        :param session: 回答依赖的会话上下文，None 为和上下文无关、所有会话共用
+        """
+        if not self.enable or self.skips(backend):
+            return None
+        q = normalize(question)
+        if not q or len(q) > self.max_chars:  # 长问题几乎不会重复
+            return None
+        if q.startswith("#"):  # 命令
+            return None
+        return backend, persona, session, q
+
+    def skips(self, backend: Optional[str]) -> bool:
+        """模型的回答是否不共用"""
+        return backend is not None and backend.lower() in self.skip
+
+    def ask(self, key: Optional[Tuple], fetch: Callable[[], str],
+            shareable: Optional[Callable[[], bool]] = None,
+            on_shared: Optional[Callable[[str], None]] = None) -> str:
+        """有缓存用缓存，有人在问就等他的回答，否则调用 fetch 并缓存回答
+        :param shareable: fetch 之后判断回答能不能给别人用，比如实际回答的模型在 skip 里
+        :param on_shared: 用了别人的回答时调用，把问答记进自己的对话记录
+        """
+        if key is None:
+            return fetch()
+
+        future, leader = self._join(key)
+        if leader:
+            rsp = ""
+            try:
+                rsp = fetch()
+            finally:
+                self._finish(key, future, rsp, shareable)
+            return rsp
+
+        try:
+            rsp = future.result(timeout=self.wait)
+        except Exception as e:
+            self.LOG.warning(f"等待相同问题的回答失败：{e}")
+            return ""
+        if rsp is None:  # 那个回答不能共用，自己问
+            return fetch()
+        return self._shared(rsp, on_shared)
+
+    async def async_ask(self, key: Optional[Tuple], fetch: Callable[[], Awaitable[str]],
+                        shareable: Optional[Callable[[], bool]] = None,
+                        on_shared: Optional[Callable[[str], None]] = None) -> str:
+        """ask 的异步版本"""
+        if key is None:
+            return await fetch()
+
+        future, leader = self._join(key)
+        if leader:
+            rsp = ""
+            try:
+                rsp = await fetch()
+            finally:
+                self._finish(key, future, rsp, shareable)
+            return rsp
+
+        try:
+            rsp = await asyncio.wait_for(asyncio.wrap_future(future), self.wait)
+        except Exception as e:
+            self.LOG.warning(f"等待相同问题的回答失败：{e}")
+            return ""
+        if rsp is None:
+            return await fetch()
+        return self._shared(rsp, on_shared)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._answers), "inflight": len(self._flights), "hits": self.hits,
+                    "coalesced": self.coalesced, "misses": self.misses}
+
+    def _join(self, key: Tuple) -> Tuple[Future, bool]:
+        """返回 (结果, 是否由自己调用模型)；命中缓存时结果已经完成"""
+        with self._lock:
+            rsp = self._get(key, time.monotonic())
+            if rsp:
+                future = Future()
+                future.set_result(rsp)
+                return future, False
+
+            future = self._flights.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+
+            future = self._flights[key] = Future()
+            self.misses += 1
+            return future, True
+
+    def _shared(self, rsp: str, on_shared: Optional[Callable[[str], None]]) -> str:
+        if rsp and on_shared:
+            try:
+                on_shared(rsp)
+            except Exception as e:
+                self.LOG.error(f"记录共用的回答出错：{e}")
+        return rsp
+
+    def _finish(self, key: Tuple, future: Future, rsp: str, shareable: Optional[Callable[[], bool]]) -> None:
+        """记下回答并通知等待的人；没有回答不缓存，不能共用时让等待的人自己问"""
+        if rsp and shareable and not shareable():
+            rsp = None
+        with self._lock:
+            self._flights.pop(key, None)
+            if rsp:
+                now = time.monotonic()
+                self._expire(now)
+                self._answers.pop(key, None)
+                self._answers[key] = (rsp, now + self.ttl)
+                if len(self._answers) > self.max_size:
+                    self._answers.popitem(last=False)
+        future.set_result(rsp)
+
+    def _get(self, key: Tuple, now: float) -> str:
+        item = self._answers.get(key)
+        if item is None or item[1] <= now:
+            return ""
+        self.hits += 1
+        return item[0]
+
+    def _expire(self, now: float) -> None:
+        # 按写入时间排序，遇到未过期的就可以停了
+        while self._answers:
+            key, (_, expires) = next(iter(self._answers.items()))
+            if expires > now:
+                break
+            del self._answers[key]
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+from queue import Empty
+from threading import Semaphore, Thread
+from typing import Dict, List
+
+from wcferry import Wcf, WxMsg
+
+from metrics import QUEUE_DEPTH
+from msg_admission import MsgAdmission
+
+
+class AsyncRuntime(object):
+    """asyncio 消息运行时
+    wcferry 的消息在独立线程中接收，经过和线程运行时相同的入站队列（丢弃、合并策略）后投递到事件循环。
+    闲聊走模型的 async_get_answer，大量等待中的模型请求共用一个线程；其他消息仍在线程池中调用 Robot.processMsg。
+    同一会话的消息按到达顺序处理。
+    """
+
+    def __init__(self, robot, max_inflight: int = 256) -> None:
+        self.LOG = logging.getLogger("AsyncRuntime")
+        self.robot = robot
+        self.wcf: Wcf = robot.wcf
+        self.max_inflight = max(1, int(max_inflight))
+        self.loop = asyncio.new_event_loop()
+        self.admission: MsgAdmission = None
+        self._slots = Semaphore(self.max_inflight)
+        self.inflight = 0  # 处理中的消息数
+        self._locks: Dict[str, List] = {}
+
+    def start(self) -> None:
+        """启动事件循环线程、消息接收线程和分发线程"""
+        self.admission = self.robot.createAdmission()
+        QUEUE_DEPTH.set_function(self.depth, queue="async")
+        Thread(target=self._run_loop, name="AsyncLoop", daemon=True).start()
+        self.wcf.enable_receiving_msg()
+        Thread(target=self._receive, name="GetMessage", daemon=True).start()
+        Thread(target=self._dispatch, name="DispatchMessage", daemon=True).start()
+
+    def _run_loop(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def _receive(self) -> None:
+        while self.wcf.is_receiving_msg():
+            try:
+                msg = self.wcf.get_msg()
+                if self.robot.acceptMsg(msg):
+                    self.admission.put(msg)
+            except Empty:
+                continue  # Empty message
+            except Exception as e:
+                self.LOG.error(f"Receiving message error: {e}")
+
+    def _dispatch(self) -> None:
+        # 处理中的消息达到上限时在这里等待，积压留在入站队列里按策略丢弃
+        while self.wcf.is_receiving_msg():
+            try:
+                msg = self.admission.get(timeout=1)
+            except Empty:
+                continue
+            self._slots.acquire()
+            self.loop.call_soon_threadsafe(self._spawn, msg)
+
+    def _spawn(self, msg: WxMsg) -> None:
+        self.inflight += 1
+        task = self.loop.create_task(self._handle(msg))
+        task.add_done_callback(self._done)
+
+    def _done(self, _) -> None:
+        self.inflight -= 1
+        self._slots.release()
+
+    def depth(self) -> int:
+        """处理中的消息数，排队中的见入站队列"""
+        return self.inflight
+
+    async def _handle(self, msg: WxMsg) -> None:
+        key = self.robot.conversationKey(msg)
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])  # [锁, 使用中的任务数]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                if self.robot.isChitchatMsg(msg):
+                    await self.robot.toChitchatAsync(msg)
+                else:
+                    await self.loop.run_in_executor(None, self.robot.processMsg, msg)
+        except Exception as e:
+            self.LOG.error(f"处理消息出错：{e}")
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
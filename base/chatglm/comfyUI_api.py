@@ -7,11 +7,12 @@ import random
 import urllib
 import uuid
 
-import requests
 # NOTE: websocket-client (https://github.com/websocket-client/websocket-client)
 import websocket
 from PIL import Image
 
+from http_client import session
+
 
 class ComfyUIApi():
     def __init__(self, server_address="127.0.0.1:8188"):
@@ -24,7 +25,7 @@ class ComfyUIApi():
     def queue_prompt(self, prompt):
         p = {"prompt": prompt, "client_id": self.client_id}
         data = json.dumps(p).encode('utf-8')
-        req = requests.post(
+        req = session.post(
             "http://{}/prompt".format(self.server_address), data=data)
         print(req.text)
         return json.loads(req.text)
@@ -33,7 +34,7 @@ class ComfyUIApi():
         data = {"filename": filename,
                 "subfolder": subfolder, "type": folder_type}
         url_values = urllib.parse.urlencode(data)
-        with requests.get("http://{}/view?{}".format(self.server_address, url_values)) as response:
+        with session.get("http://{}/view?{}".format(self.server_address, url_values)) as response:
             image = Image.open(io.BytesIO(response.content))
             return image
 
@@ -44,7 +45,7 @@ class ComfyUIApi():
         return "http://{}/view?{}".format(self.server_address, url_values)
 
     def get_history(self, prompt_id):
-        with requests.get("http://{}/history/{}".format(self.server_address, prompt_id)) as response:
+        with session.get("http://{}/history/{}".format(self.server_address, prompt_id)) as response:
             return json.loads(response.text)
 
     def get_images(self, prompt, isUrl=False):
@@ -10,6 +10,7 @@ from typing import Annotated, get_origin
 
 from base.chatglm.comfyUI_api import ComfyUIApi
 from base.func_news import News
+from http_client import session
 from zhdate import ZhDate
 
 _TOOL_HOOKS = {}
@@ -109,9 +110,8 @@ def get_weather(
     key_selection = {
         "current_condition": ["temp_C", "FeelsLikeC", "humidity", "weatherDesc", "observation_time"],
     }
-    import requests
     try:
-        resp = requests.get(f"https://wttr.in/{city_name}?format=j1")
+        resp = session.get(f"https://wttr.in/{city_name}?format=j1")
         resp.raise_for_status()
         resp = resp.json()
         ret = {k: {_v: resp[k][0][_v] for _v in v}
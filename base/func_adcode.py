@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import pickle
+from array import array
+from threading import Lock
+from typing import List, Optional
+
+from base.func_city_matcher import CityMatcher
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Adcode(object):
+    """高德行政区划编码表
+    AMap_adcode_citycode.xlsx 只解析一次，结果以 pickle 缓存在旁边，xlsx 修改时间变化后才重新解析。
+    名称重复的（如各地的“朝阳区”）保留表中第一条。
+    """
+
+    def __init__(self, xlsx: str = os.path.join(ROOT, "AMap_adcode_citycode.xlsx")) -> None:
+        self.LOG = logging.getLogger("Adcode")
+        self.xlsx = xlsx
+        self.cache = os.path.splitext(xlsx)[0] + ".pkl"
+        self.names: List[str] = []
+        self._adcodes = array("I")
+        self._citycodes = array("I")  # 0 为没有城市编码
+        self._index = {}  # 名称 -> 下标
+        self._matcher: CityMatcher = None
+        self._mtime = None
+        self._lock = Lock()
+
+    def _ensure_loaded(self) -> None:
+        mtime = os.path.getmtime(self.xlsx)
+        if mtime == self._mtime:
+            return
+
+        with self._lock:
+            if mtime == self._mtime:
+                return
+            data = self._load_cache(mtime) or self._build(mtime)
+            self.names = data["names"]
+            self._adcodes = data["adcodes"]
+            self._citycodes = data["citycodes"]
+            self._index = {}
+            for i, name in enumerate(self.names):
+                self._index.setdefault(name, i)
+            # adcode 后四位为 0 的是省级（含直辖市）
+            self._matcher = CityMatcher(self.names, [a % 10000 == 0 for a in self._adcodes])
+            self._mtime = mtime
+
+    def _load_cache(self, mtime: float) -> Optional[dict]:
+        try:
+            with open(self.cache, "rb") as fp:
+                data = pickle.load(fp)
+            if data.get("mtime") == mtime:
+                return data
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            pass
+        return None
+
+    def _build(self, mtime: float) -> dict:
+        import pandas as pd  # 只有重建缓存时才需要
+
+        self.LOG.info(f"解析 {self.xlsx}")
+        df = pd.read_excel(self.xlsx)
+        data = {
+            "mtime": mtime,
+            "names": [str(n) for n in df["中文名"]],
+            "adcodes": array("I", (int(a) for a in df["adcode"])),
+            "citycodes": array("I", (0 if pd.isna(c) else int(c) for c in df["citycode"])),
+        }
+        try:
+            with open(self.cache, "wb") as fp:
+                pickle.dump(data, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError as e:
+            self.LOG.warning(f"写入缓存失败：{e}")
+        return data
+
+    def all_names(self) -> List[str]:
+        """全部地名"""
+        self._ensure_loaded()
+        return self.names
+
+    def match_city(self, text: str) -> Optional[str]:
+        """从一句话里找出地名，如 “北京天气怎么样” -> “北京市”"""
+        self._ensure_loaded()
+        return self._matcher.match(text)
+
+    def match_cities(self, texts: List[str]) -> List[Optional[str]]:
+        """批量找出地名"""
+        self._ensure_loaded()
+        return self._matcher.match_many(texts)
+
+    def get_adcode(self, name: str) -> Optional[str]:
+        """按地名精确查找区域编码"""
+        self._ensure_loaded()
+        i = self._index.get(name)
+        return None if i is None else str(self._adcodes[i])
+
+    def get_citycode(self, name: str) -> Optional[str]:
+        """按地名精确查找城市编码（电话区号）"""
+        self._ensure_loaded()
+        i = self._index.get(name)
+        if i is None or not self._citycodes[i]:
+            return None
+        code = self._citycodes[i]
+        # 表里按数字存，丢了区号开头的 0；港澳的 1852、1853 本来就没有
+        return str(code) if code >= 1000 else f"0{code}"
+
+
+adcode = Adcode()
+
+if __name__ == "__main__":
+    print(adcode.get_adcode("北京市"), adcode.get_citycode("北京市"))
@@ -29,6 +29,10 @@ class BardAssistant:
         response = self._bard.generate_content([{'role': 'user', 'parts': [msg]}])
         return response.text
 
+    async def async_get_answer(self, msg: str, sender: str = None) -> str:
+        response = await self._bard.generate_content_async([{'role': 'user', 'parts': [msg]}])
+        return response.text
+
 
 if __name__ == "__main__":
     from configuration import Config
@@ -2,14 +2,18 @@
 # -*- coding: utf-8 -*-
 
 import json
+import logging
 import os
 import random
 from datetime import datetime
-from typing import Optional
+from typing import Iterator, Optional
 
 import openai
 from base.chatglm.code_kernel import CodeKernel, execute
 from base.chatglm.tool_registry import dispatch_tool, extract_code, get_tools
+from base.func_image_variants import ImageVariants
+from base.func_memory import ConversationMemory, store, summary_request
+from base.func_persona import personas
 from wcferry import Wcf
 
 functions = get_tools()
@@ -17,26 +21,40 @@ functions = get_tools()
 
 class ChatGLM:
 
-    def __init__(self, config={}, wcf: Optional[Wcf] = None, max_retry=5) -> None:
+    def __init__(self, config={}, wcf: Optional[Wcf] = None, max_retry=5,
+                 image_variants: Optional[ImageVariants] = None) -> None:
+        self.LOG = logging.getLogger("ChatGLM")
         openai.api_key = config.get("key", "empty")
         # 自己搭建或第三方代理的接口
         openai.api_base = config["api"]
         proxy = config.get("proxy")
         if proxy:
             openai.proxy = {"http": proxy, "https": proxy}
-        self.conversation_list = {}
-        self.chat_type = {}
         self.max_retry = max_retry
         self.wcf = wcf
+        self.image_variants = image_variants  # 发送前压缩图片
         self.filePath = config["file_path"]
         self.kernel = CodeKernel()
         self.system_content_msg = {"chat": [{"role": "system", "content": config["prompt"]}],
                                    "tool": [{"role": "system", "content": "Answer the following questions as best as you can. You have access to the following tools:"}],
                                    "code": [{"role": "system", "content": "你是一位智能AI助手，你叫ChatGLM，你连接着一台电脑，但请注意不能联网。在使用Python解决任务时，你可以运行代码并得到结果，如果运行结果有错误，你需要尽可能对代码进行改进。你可以处理用户上传到电脑上的文件，文件默认存储路径是{}。".format(self.filePath)}]}
+        # 对话记录按 (wxid, 模式) 保存；当前模式记在聊天模式会话的状态里，跟着会话一起移出内存、持久化
+        self.memory = ConversationMemory(config.get("history_tokens", 3000),
+                                         self.summarize if config.get("summarize", True) else None,
+                                         namespace="ChatGLM",
+                                         capacity=config.get("memory_tokens", 200000),
+                                         store=store)
 
     def __repr__(self):
         return 'ChatGLM'
 
+    def send_image(self, path: str, wxid: str) -> None:
+        if not self.wcf:
+            return
+        if self.image_variants:
+            path = self.image_variants.get(path)
+        self.wcf.send_image(path, wxid)
+
     @staticmethod
     def value_check(conf: dict) -> bool:
         if conf:
@@ -44,33 +62,46 @@ class ChatGLM:
                 return True
         return False
 
+    def mode(self, wxid: str) -> str:
+        """会话当前的模式，默认聊天模式"""
+        return self.memory.get_state((wxid, 'chat'), 'mode', 'chat')
+
+    def setMode(self, wxid: str, mode: str) -> None:
+        # 只记录工具、代码模式，聊天模式不占状态
+        self.memory.set_state((wxid, 'chat'), 'mode', None if mode == 'chat' else mode)
+
     def get_answer(self, question: str, wxid: str) -> str:
+        """模型出错时抛出异常，错误信息不作为回答返回"""
         # wxid或者roomid,个人时为微信id，群消息时为群id
         if '#帮助' == question:
             return '本助手有三种模式，#聊天模式 = #1 ，#工具模式 = #2 ，#代码模式 = #3 , #清除模式会话 = #4 , #清除全部会话 = #5 可用发送#对应模式 或者 #编号 进行切换'
         elif '#聊天模式' == question or '#1' == question:
-            self.chat_type[wxid] = 'chat'
+            self.setMode(wxid, 'chat')
             return '已切换#聊天模式'
         elif '#工具模式' == question or '#2' == question:
-            self.chat_type[wxid] = 'tool'
+            self.setMode(wxid, 'tool')
             return '已切换#工具模式 \n工具有：查看天气，日期，新闻,comfyUI文生图。例如：\n帮我生成一张小鸟的图片，提示词必须是英文'
         elif '#代码模式' == question or '#3' == question:
-            self.chat_type[wxid] = 'code'
+            self.setMode(wxid, 'code')
             return '已切换#代码模式 \n代码模式可以用于写python代码，例如：\n用python画一个爱心'
         elif '#清除模式会话' == question or '#4' == question:
-            self.conversation_list[wxid][self.chat_type[wxid]
-                                         ] = self.system_content_msg[self.chat_type[wxid]]
+            mode = self.mode(wxid)
+            self.memory.clear((wxid, mode))
+            self.setMode(wxid, mode)  # 清除聊天模式会话时模式也被清掉了，保持当前模式
             return '已清除'
         elif '#清除全部会话' == question or '#5' == question:
-            self.conversation_list[wxid] = self.system_content_msg
+            mode = self.mode(wxid)
+            for m in self.system_content_msg:
+                self.memory.clear((wxid, m))
+            self.setMode(wxid, mode)
             return '已清除'
 
         self.updateMessage(wxid, question, "user")
 
         try:
             params = dict(model="chatglm3", temperature=1.0,
-                          messages=self.conversation_list[wxid][self.chat_type[wxid]], stream=False)
-            if 'tool' == self.chat_type[wxid]:
+                          messages=self.messages(wxid), stream=False)
+            if 'tool' == self.mode(wxid):
                 params["functions"] = functions
             response = openai.ChatCompletion.create(**params)
             for _ in range(self.max_retry):
@@ -90,7 +121,7 @@ class ChatGLM:
                             filename = observation['filename']
                             filePath = os.path.join(self.filePath, filename)
                             res.save(filePath)
-                            self.wcf and self.wcf.send_image(filePath, wxid)
+                            self.send_image(filePath, wxid)
                         tool_response = '[Image]' if res_type == 'image' else res
                     else:
                         tool_response = observation if isinstance(
@@ -122,7 +153,7 @@ class ChatGLM:
                             'abcdefghijklmnopqrstuvwxyz1234567890', 8)))
                         filePath = os.path.join(self.filePath, filename)
                         res.save(filePath)
-                        self.wcf and self.wcf.send_image(filePath, wxid)
+                        self.send_image(filePath, wxid)
                     else:
                         self.wcf and self.wcf.send_text("执行结果:\n" + res, wxid)
                     tool_response = '[Image]' if res_type == 'image' else res
@@ -143,30 +174,63 @@ class ChatGLM:
 
             self.updateMessage(wxid, rsp, "assistant")
         except Exception as e0:
-            rsp = "发生未知错误：" + str(e0)
+            self.LOG.error(f"发生未知错误：{e0}")
+            raise
 
         return rsp
 
+    def stream_answer(self, question: str, wxid: str) -> Iterator[str]:
+        """聊天模式下流式回答；命令、工具模式、代码模式需要完整结果，一次返回"""
+        if question.startswith('#') or self.mode(wxid) != 'chat':
+            yield self.get_answer(question, wxid)
+            return
+
+        self.updateMessage(wxid, question, "user")
+        parts = []
+        try:
+            response = openai.ChatCompletion.create(model="chatglm3", temperature=1.0,
+                                                    messages=self.messages(wxid), stream=True)
+            for chunk in response:
+                delta = chunk.choices[0].delta.get("content")
+                if delta:
+                    parts.append(delta)
+                    yield delta
+        except Exception as e0:
+            # 让调用方知道没有回答或者回答不完整；已经输出的部分不记入会话
+            self.LOG.error(f"发生未知错误：{e0}")
+            raise
+
+        self.updateMessage(wxid, "".join(parts), "assistant")
+
+    def summarize(self, old: str, messages: list) -> str:
+        """把移出对话记录的消息压缩进摘要"""
+        response = openai.ChatCompletion.create(model="chatglm3", temperature=0.2,
+                                                messages=summary_request(old, messages))
+        return response.choices[0].message.content
+
+    def messages(self, wxid: str) -> list:
+        """当前模式的系统设定（聊天模式优先用会话人设）+ 对话记录"""
+        mode = self.mode(wxid)
+        system = self.system_content_msg[mode]
+        if mode == 'chat':
+            system = [personas.message(wxid, system[0])]
+        return system + self.memory.messages((wxid, mode))
+
+    def history(self, wxid: str) -> list:
+        """会话当前模式的对话记录（含摘要），不含系统设定"""
+        return self.memory.messages((wxid, self.mode(wxid)))
+
+    def remember(self, wxid: str, question: str, answer: str) -> None:
+        """记下没有经过模型的问答，如共用的缓存回答"""
+        self.updateMessage(wxid, question, "user")
+        self.updateMessage(wxid, answer, "assistant")
+
     def updateMessage(self, wxid: str, question: str, role: str) -> None:
-        now_time = str(datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-
-        # 初始化聊天记录,组装系统信息
-        if wxid not in self.conversation_list.keys():
-            self.conversation_list[wxid] = self.system_content_msg
-        if wxid not in self.chat_type.keys():
-            self.chat_type[wxid] = 'chat'
-
-        # 当前问题
-        content_question_ = {"role": role, "content": question}
-        self.conversation_list[wxid][self.chat_type[wxid]].append(
-            content_question_)
-
-        # 只存储10条记录，超过滚动清除
-        i = len(self.conversation_list[wxid][self.chat_type[wxid]])
-        if i > 10:
-            print("滚动清除微信记录：" + wxid)
-            # 删除多余的记录，倒着删，且跳过第一个的系统消息
-            del self.conversation_list[wxid][self.chat_type[wxid]][1]
+        # 对话记录按 token 预算保存，超出时最早的消息移出并压缩成摘要
+        # 聊天模式会带上会话人设，它的 token 数从预算里扣除
+        mode = self.mode(wxid)
+        reserve = personas.tokens(wxid) if mode == 'chat' else 0
+        self.memory.append((wxid, mode), {"role": role, "content": question}, reserve=reserve)
 
 
 if __name__ == "__main__":
@@ -3,9 +3,13 @@
 
 import logging
 from datetime import datetime
+from typing import Iterator
 
 import httpx
-from openai import APIConnectionError, APIError, AuthenticationError, OpenAI
+from openai import APIConnectionError, APIError, AsyncOpenAI, AuthenticationError, OpenAI
+
+from base.func_memory import ConversationMemory, store, summary_request
+from base.func_persona import personas
 
 
 class ChatGPT():
@@ -18,10 +22,16 @@ class ChatGPT():
         self.LOG = logging.getLogger("ChatGPT")
         if proxy:
             self.client = OpenAI(api_key=key, base_url=api, http_client=httpx.Client(proxy=proxy))
+            self.async_client = AsyncOpenAI(api_key=key, base_url=api, http_client=httpx.AsyncClient(proxy=proxy))
         else:
             self.client = OpenAI(api_key=key, base_url=api)
-        self.conversation_list = {}
+            self.async_client = AsyncOpenAI(api_key=key, base_url=api)
         self.system_content_msg = {"role": "system", "content": prompt}
+        self.memory = ConversationMemory(conf.get("history_tokens", 3000),
+                                         self.summarize if conf.get("summarize", True) else None,
+                                         namespace="ChatGPT",
+                                         capacity=conf.get("memory_tokens", 200000),
+                                         store=store)
 
     def __repr__(self):
         return 'ChatGPT'
@@ -39,51 +49,95 @@ class ChatGPT():
         rsp = ""
         try:
             ret = self.client.chat.completions.create(model=self.model,
-                                                      messages=self.conversation_list[wxid],
+                                                      messages=self.messages(wxid),
                                                       temperature=0.2)
-            rsp = ret.choices[0].message.content
-            rsp = rsp[2:] if rsp.startswith("\n\n") else rsp
-            rsp = rsp.replace("\n\n", "\n")
-            self.updateMessage(wxid, rsp, "assistant")
-        except AuthenticationError:
-            self.LOG.error("OpenAI API 认证失败，请检查 API 密钥是否正确")
-        except APIConnectionError:
-            self.LOG.error("无法连接到 OpenAI API，请检查网络连接")
-        except APIError as e1:
-            self.LOG.error(f"OpenAI API 返回了错误：{str(e1)}")
-        except Exception as e0:
-            self.LOG.error(f"发生未知错误：{str(e0)}")
+            rsp = self._on_answer(wxid, ret.choices[0].message.content)
+        except Exception as e:
+            self._on_error(e)
 
         return rsp
 
-    def updateMessage(self, wxid: str, question: str, role: str) -> None:
-        now_time = str(datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    async def async_get_answer(self, question: str, wxid: str) -> str:
+        self.updateMessage(wxid, question, "user")
+        rsp = ""
+        try:
+            ret = await self.async_client.chat.completions.create(model=self.model,
+                                                                  messages=self.messages(wxid),
+                                                                  temperature=0.2)
+            rsp = self._on_answer(wxid, ret.choices[0].message.content)
+        except Exception as e:
+            self._on_error(e)
+
+        return rsp
+
+    def stream_answer(self, question: str, wxid: str) -> Iterator[str]:
+        """流式回答，逐段返回模型输出，结束后把完整回答记入会话
+        中途出错时抛出异常，调用方据此知道回答不完整；已经输出的部分不记入会话
+        """
+        self.updateMessage(wxid, question, "user")
+        parts = []
+        try:
+            stream = self.client.chat.completions.create(model=self.model,
+                                                         messages=self.messages(wxid),
+                                                         temperature=0.2,
+                                                         stream=True)
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    yield delta
+        except Exception as e:
+            self._on_error(e)
+            raise
 
+        if parts:
+            self._on_answer(wxid, "".join(parts))
+
+    def _on_answer(self, wxid: str, rsp: str) -> str:
+        rsp = rsp[2:] if rsp.startswith("\n\n") else rsp
+        rsp = rsp.replace("\n\n", "\n")
+        self.updateMessage(wxid, rsp, "assistant")
+        return rsp
+
+    def _on_error(self, e: Exception) -> None:
+        if isinstance(e, AuthenticationError):
+            self.LOG.error("OpenAI API 认证失败，请检查 API 密钥是否正确")
+        elif isinstance(e, APIConnectionError):
+            self.LOG.error("无法连接到 OpenAI API，请检查网络连接")
+        elif isinstance(e, APIError):
+            self.LOG.error(f"OpenAI API 返回了错误：{str(e)}")
+        else:
+            self.LOG.error(f"发生未知错误：{str(e)}")
+
+    def summarize(self, old: str, messages: list) -> str:
+        """把移出对话记录的消息压缩进摘要"""
+        ret = self.client.chat.completions.create(model=self.model,
+                                                  messages=summary_request(old, messages),
+                                                  temperature=0.2)
+        return ret.choices[0].message.content
+
+    def messages(self, wxid: str) -> list:
+        """会话人设（没有时为系统设定）+ 对话记录 + 当前时间
+        每次都变的时间放在最后，前面不变的部分可以命中服务端的提示缓存
+        """
+        now_time = str(datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
         time_mk = "当需要回答时间时请直接参考回复:"
-        # 初始化聊天记录,组装系统信息
-        if wxid not in self.conversation_list.keys():
-            question_ = [
-                self.system_content_msg,
-                {"role": "system", "content": "" + time_mk + now_time}
-            ]
-            self.conversation_list[wxid] = question_
-
-        # 当前问题
-        content_question_ = {"role": role, "content": question}
-        self.conversation_list[wxid].append(content_question_)
-
-        for cont in self.conversation_list[wxid]:
-            if cont["role"] != "system":
-                continue
-            if cont["content"].startswith(time_mk):
-                cont["content"] = time_mk + now_time
-
-        # 只存储10条记录，超过滚动清除
-        i = len(self.conversation_list[wxid])
-        if i > 10:
-            print("滚动清除微信记录：" + wxid)
-            # 删除多余的记录，倒着删，且跳过第一个的系统消息
-            del self.conversation_list[wxid][1]
+        return ([personas.message(wxid, self.system_content_msg)] + self.memory.messages(wxid)
+                + [{"role": "system", "content": time_mk + now_time}])
+
+    def history(self, wxid: str) -> list:
+        """会话的对话记录（含摘要），不含系统设定"""
+        return self.memory.messages(wxid)
+
+    def remember(self, wxid: str, question: str, answer: str) -> None:
+        """记下没有经过模型的问答，如共用的缓存回答"""
+        self.updateMessage(wxid, question, "user")
+        self.updateMessage(wxid, answer, "assistant")
+
+    def updateMessage(self, wxid: str, question: str, role: str) -> None:
+        # 对话记录按 token 预算保存，超出时最早的消息移出并压缩成摘要
+        # 会话人设和记录一起发送，它的 token 数从预算里扣除
+        self.memory.append(wxid, {"role": role, "content": question}, reserve=personas.tokens(wxid))
 
 
 if __name__ == "__main__":
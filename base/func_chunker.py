@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+import re
+import time
+from typing import Iterable, Iterator
+
+# 在这些字符之后断开
+BOUNDARY = re.compile(r"[。！？!?；;\n]+|[.](?=\s)")
+
+
+def _last_boundary(text: str) -> int:
+    """最后一个断句位置（断句符之后），没有返回 0"""
+    end = 0
+    for m in BOUNDARY.finditer(text):
+        end = m.end()
+    return end
+
+
+def chunk_stream(tokens: Iterable[str], min_chars: int = 20, max_chars: int = 500,
+                 max_wait: float = 3) -> Iterator[str]:
+    """把模型逐字返回的内容拼成适合逐条发送的段落
+    满足以下任一条件时，在最后一个完整句子处断开输出：
+      - 已攒够 min_chars 个字
+      - 距上次输出超过 max_wait 秒
+    超过 max_chars 仍没有断句符时强制断开。结束时输出剩余内容。
+    :param tokens: 模型返回的片段
+    :param min_chars: 最少攒多少字再发
+    :param max_chars: 一段最多多少字
+    :param max_wait: 最多攒多少秒，秒
+    """
+    buf = ""
+    last = time.monotonic()
+    for token in tokens:
+        if not token:
+            continue
+        buf += token
+        while buf:
+            now = time.monotonic()
+            cut = _last_boundary(buf[:max_chars])
+            if not (cut and (cut >= min_chars or now - last >= max_wait)):
+                if len(buf) < max_chars:
+                    break
+                cut = cut or max_chars  # 太长了，有断句符就在断句符处断，没有就硬断
+
+            chunk, buf = buf[:cut].strip(), buf[cut:]
+            last = now
+            if chunk:
+                yield chunk
+
+    buf = buf.strip()
+    if buf:
+        yield buf
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence, Set
+
+# 行政区划后缀，长的在前
+SUFFIXES = ("特别行政区", "维吾尔自治区", "壮族自治区", "回族自治区", "自治区", "自治州", "自治县",
+            "地区", "林区", "省", "市", "区", "县", "盟", "旗")
+
+
+def strip_suffix(name: str) -> str:
+    """去掉行政区划后缀：“北京市” -> “北京”，去掉后不足两个字的保持原样"""
+    for suffix in SUFFIXES:
+        if name.endswith(suffix) and len(name) - len(suffix) >= 2:
+            return name[:-len(suffix)]
+    return name
+
+
+def edit_distance(a: str, b: str) -> int:
+    """编辑距离（Levenshtein）"""
+    if len(a) < len(b):
+        a, b = b, a
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        prev = cur
+    return prev[-1]
+
+
+def similarity(a: str, b: str) -> float:
+    """相似度，1 - 编辑距离 / 较长的长度"""
+    return 1 - edit_distance(a, b) / max(len(a), len(b), 1)
+
+
+class CityMatcher(object):
+    """从一句话里找出地名
+    全称和去掉后缀的简称按二元组建倒排索引，先用消息里的二元组筛出候选，再逐个精确比对。
+    精确匹配的规则：被更长的命中包含的不算；市、区县优先于省（“浙江杭州” -> 杭州市）；
+    同一级别命中越长越好（全称优先于简称）；一样长时取在消息里出现得早的；再一样取表里靠前的。
+    没有精确命中时模糊匹配：三个字以上的简称和消息里长度相近的片段算编辑距离，相似度不低于 threshold 的取最相似的，
+    可以容忍错别字和少写一个字（“哈儿滨”、“呼和浩” -> 哈尔滨市、呼和浩特市）；两个字的地名错一个字就分不清了，只精确匹配。
+    """
+
+    def __init__(self, names: List[str], provinces: Sequence[bool] = None, threshold: float = 0.66) -> None:
+        """
+        :param names: 地名
+        :param provinces: 和 names 一一对应，是否为省级（含直辖市），为空时都当作同一级别
+        :param threshold: 模糊匹配的最低相似度
+        """
+        self.names = names
+        self.threshold = threshold
+        self._levels = [0 if p else 1 for p in provinces] if provinces else [1] * len(names)
+        self._keys: List[List[str]] = []  # 地名下标 -> [全称, 简称]
+        self._index: Dict[str, Set[int]] = defaultdict(set)  # 二元组 -> 地名下标
+        self._chars: Dict[str, Set[int]] = defaultdict(set)  # 单字 -> 可模糊匹配的地名下标
+        for i, name in enumerate(names):
+            keys = [name]
+            short = strip_suffix(name)
+            if short != name:
+                keys.append(short)
+            self._keys.append(keys)
+            for key in keys:
+                # 只用开头的二元组即可：地名命中时，它的开头二元组必然出现在消息里
+                self._index[key[:2]].add(i)
+            if len(short) >= 3:
+                for ch in set(short):
+                    self._chars[ch].add(i)
+
+    def match(self, text: str) -> Optional[str]:
+        """返回 text 中最匹配的地名，没有则返回 None"""
+        hits = []  # (开始, 结束, 地名下标, 得分)
+        for i in self._candidates(text):
+            for key in self._keys[i]:
+                pos = text.find(key)
+                if pos < 0:
+                    continue
+                # 全称比同长度的简称多 1 分
+                hits.append((pos, pos + len(key), i, (self._levels[i], len(key) + (key == self.names[i]), -pos, -i)))
+                break  # 全称命中就不用再看简称
+        if not hits:
+            return self._fuzzy(text)
+
+        # 被更长的命中包含的不算，如“黑龙江”里的“龙江”、“上城区”里的“城区”
+        hits = [h for h in hits if not any(o[0] <= h[0] and h[1] <= o[1] and o[1] - o[0] > h[1] - h[0]
+                                           for o in hits)]
+        return self.names[max(hits, key=lambda h: h[3])[2]]
+
+    def match_many(self, texts: Iterable[str]) -> List[Optional[str]]:
+        """批量匹配"""
+        return [self.match(text) for text in texts]
+
+    def _candidates(self, text: str) -> Set[int]:
+        candidates = set()
+        for j in range(len(text) - 1):
+            ids = self._index.get(text[j:j + 2])
+            if ids:
+                candidates |= ids
+        return candidates
+
+    def _fuzzy(self, text: str) -> Optional[str]:
+        # 先按单字倒排索引筛出候选：每处编辑最多让简称少一个字出现在消息里
+        hits: Dict[int, int] = defaultdict(int)
+        for ch in set(text):
+            for i in self._chars.get(ch, ()):
+                hits[i] += 1
+
+        best = None  # (相似度, 级别, -出现位置, -表中下标)
+        for i, n in hits.items():
+            key = self._keys[i][-1]
+            if n < len(set(key)) - int((1 - self.threshold) * (len(key) + 1)):
+                continue
+            for size in (len(key), len(key) - 1, len(key) + 1):
+                for pos in range(len(text) - size + 1):
+                    score = (similarity(key, text[pos:pos + size]), self._levels[i], -pos, -i)
+                    if score[0] >= self.threshold and (best is None or score > best):
+                        best = score
+        return None if best is None else self.names[-best[3]]
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import logging
+import os
+from threading import Lock
+from typing import Dict, Iterable, Tuple
+
+from PIL import Image
+
+
+class ImageVariants(object):
+    """发送前的图片压缩缓存
+    按 max_side/quality 生成缩小、重新压缩的版本，以 内容哈希-配置 命名存在 cache_dir，
+    内容相同的图片只生成一次。源文件的修改时间或大小变化时才重新计算哈希。
+    GIF（可能是动图）、压缩后反而更大、或处理失败的图片直接发原图。
+    """
+
+    def __init__(self, cache_dir: str, max_side: int = 1280, quality: int = 80) -> None:
+        """
+        :param cache_dir: 缓存目录
+        :param max_side: 长边最大像素
+        :param quality: JPEG 质量
+        """
+        self.LOG = logging.getLogger("ImageVariants")
+        self.cache_dir = cache_dir
+        self.max_side = max_side
+        self.quality = quality
+        self.profile = f"{max_side}q{quality}"
+        self._sources: Dict[str, Tuple[float, int, str]] = {}  # 源文件 -> (修改时间, 大小, 发送用的文件)
+        self._lock = Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, path: str) -> str:
+        """返回 path 发送用的文件，需要时生成"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return path
+
+        cached = self._sources.get(path)
+        if cached and cached[:2] == (st.st_mtime, st.st_size) and os.path.exists(cached[2]):
+            return cached[2]
+
+        with self._lock:  # 同一时间只压缩一张，避免同一张图被并发重复处理
+            try:
+                variant = self._build(path, st.st_size)
+            except Exception as e:
+                self.LOG.error(f"压缩图片 {path} 失败：{e}")
+                variant = path
+            self._sources[path] = (st.st_mtime, st.st_size, variant)
+        return variant
+
+    def warm(self, paths: Iterable[str]) -> None:
+        """预先生成"""
+        for path in paths:
+            self.get(path)
+
+    def _build(self, path: str, size: int) -> str:
+        with open(path, "rb") as fp:
+            digest = hashlib.blake2b(fp.read(), digest_size=16).hexdigest()
+
+        for ext in (".jpg", ".png"):
+            variant = os.path.join(self.cache_dir, f"{digest}-{self.profile}{ext}")
+            if os.path.exists(variant):
+                return variant
+
+        with Image.open(path) as img:
+            if img.format == "GIF":
+                return path
+            img.thumbnail((self.max_side, self.max_side))
+            if img.mode in ("RGBA", "LA", "P"):  # 可能带透明，保存为 PNG
+                variant = os.path.join(self.cache_dir, f"{digest}-{self.profile}.png")
+                save = {"format": "PNG", "optimize": True}
+            else:
+                img = img.convert("RGB")
+                variant = os.path.join(self.cache_dir, f"{digest}-{self.profile}.jpg")
+                save = {"format": "JPEG", "quality": self.quality, "optimize": True, "progressive": True}
+
+            tmp = f"{variant}.{os.getpid()}.tmp"
+            img.save(tmp, **save)
+
+        if os.path.getsize(tmp) >= size:  # 原图已经够小
+            os.remove(tmp)
+            return path
+        os.replace(tmp, variant)
+        self.LOG.info(f"压缩图片 {path} -> {variant}")
+        return variant
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import random
+import re
+import time
+from threading import Lock
+from typing import Dict, List, Optional
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp")
+# 文件名去掉结尾的编号就是标签：“笑1.jpg” -> “笑”，“读书_2.png” -> “读书”，“哭.jpg” -> “哭”
+TAG_PATTERN = re.compile(r"^(.*?)[\s_\-]*\d*$")
+
+
+def parse_tag(filename: str) -> str:
+    stem = os.path.splitext(filename)[0]
+    return TAG_PATTERN.match(stem).group(1) or stem
+
+
+class ImageCatalog(object):
+    """表情图目录
+    启动时扫描一次，按文件名建立 标签 -> 图片路径 的索引，发图时直接随机取。
+    标签来自文件名，新增一类图片只要放进目录即可。
+    目录的修改时间变化时（增删改名）才重新列目录，且只增删有变化的文件；检查最多每 refresh 秒一次。
+    """
+
+    def __init__(self, directory: str, refresh: float = 10) -> None:
+        """
+        :param directory: 图片目录
+        :param refresh: 检查目录变化的最小间隔，秒
+        """
+        self.LOG = logging.getLogger("ImageCatalog")
+        self.directory = directory
+        self.refresh = refresh
+        self._files: Dict[str, str] = {}  # 文件名 -> 标签
+        self._tags: Dict[str, List[str]] = {}  # 标签 -> 图片路径
+        self._all: List[str] = []
+        self._mtime = None
+        self._checked = 0
+        self._lock = Lock()
+        self._scan()
+
+    def _scan(self) -> None:
+        try:
+            mtime = os.path.getmtime(self.directory)
+            if mtime == self._mtime:
+                return
+            names = {n for n in os.listdir(self.directory) if n.lower().endswith(IMAGE_EXTS)}
+        except OSError as e:
+            self.LOG.error(f"读取图片目录失败：{e}")
+            return
+
+        added = names - self._files.keys()
+        removed = self._files.keys() - names
+        # 在副本上修改再整体替换，发图的线程不会读到改了一半的列表
+        files = dict(self._files)
+        tags = {tag: list(paths) for tag, paths in self._tags.items()}
+        all_paths = list(self._all)
+        for name in removed:
+            path = os.path.join(self.directory, name)
+            tags[files.pop(name)].remove(path)
+            all_paths.remove(path)
+        for name in sorted(added):
+            path = os.path.join(self.directory, name)
+            tag = files[name] = parse_tag(name)
+            tags.setdefault(tag, []).append(path)
+            all_paths.append(path)
+        self._files = files
+        self._tags = {tag: paths for tag, paths in tags.items() if paths}
+        self._all = all_paths
+        self._mtime = mtime
+        if added or removed:
+            self.LOG.info(f"图片目录更新：新增 {len(added)}，删除 {len(removed)}，标签 {sorted(self._tags)}")
+
+    def _maybe_refresh(self) -> None:
+        now = time.monotonic()
+        if now - self._checked < self.refresh:
+            return
+        with self._lock:
+            if now - self._checked < self.refresh:
+                return
+            self._checked = now
+            self._scan()
+
+    def tags(self) -> List[str]:
+        """全部标签"""
+        self._maybe_refresh()
+        return list(self._tags)
+
+    def paths(self) -> List[str]:
+        """全部图片路径"""
+        self._maybe_refresh()
+        return list(self._all)
+
+    def pick(self, tag: str = "") -> Optional[str]:
+        """随机取一张 tag 标签的图片，标签为空或不存在时从全部图片里取，没有图片返回 None"""
+        self._maybe_refresh()
+        paths = self._tags.get(tag) or self._all
+        return random.choice(paths) if paths else None
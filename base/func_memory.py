@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+
+import atexit
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from threading import Lock
+from typing import Callable, Dict, Hashable, Iterator, List, Optional, Tuple
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:  # 没装 tiktoken 时按字数估算
+    _encoding = None
+
+_CJK = re.compile(r"[⺀-鿿가-힯＀-￯]")
+MESSAGE_OVERHEAD = 4  # 每条消息的角色、分隔符等
+SUMMARY_PREFIX = "之前的对话摘要："
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def count_tokens(text: str) -> int:
+    """估算 token 数：有 tiktoken 时精确计算，否则中文每字算 1 个，其他每 4 个字符算 1 个"""
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def message_tokens(message: dict) -> int:
+    return count_tokens(str(message.get("content") or "")) + MESSAGE_OVERHEAD
+
+
+class ConversationStore(object):
+    """对话记录的 SQLite 存储，各个模型按 namespace 区分
+    内存里放不下的会话写到这里，用到时再读回来；重启后也能接着之前的对话。
+    """
+
+    def __init__(self, path: str) -> None:
+        self.LOG = logging.getLogger("ConversationStore")
+        self.path = path
+        self._conn: sqlite3.Connection = None
+        self._lock = Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS conversations ("
+                               "namespace TEXT, key TEXT, data TEXT, updated REAL, PRIMARY KEY (namespace, key))")
+        return self._conn
+
+    def load(self, namespace: str, key: Hashable) -> Optional[dict]:
+        try:
+            with self._lock:
+                row = self._connect().execute("SELECT data FROM conversations WHERE namespace = ? AND key = ?",
+                                              (namespace, json.dumps(key, ensure_ascii=False))).fetchone()
+            return json.loads(row[0]) if row else None
+        except (sqlite3.Error, ValueError) as e:
+            self.LOG.error(f"读取对话记录失败：{e}")
+            return None
+
+    def save(self, namespace: str, items: Dict[Hashable, dict]) -> None:
+        now = time.time()
+        rows = []
+        for k, v in items.items():
+            try:
+                rows.append((namespace, json.dumps(k, ensure_ascii=False), json.dumps(v, ensure_ascii=False), now))
+            except (TypeError, ValueError) as e:  # 不能序列化的会话跳过，不影响其他会话
+                self.LOG.error(f"对话记录无法保存：{k}: {e}")
+        if not rows:
+            return
+        try:
+            with self._lock:
+                conn = self._connect()
+                conn.executemany("INSERT OR REPLACE INTO conversations VALUES (?, ?, ?, ?)", rows)
+                conn.commit()
+        except sqlite3.Error as e:
+            self.LOG.error(f"保存对话记录失败：{e}")
+
+    def delete(self, namespace: str, key: Hashable) -> None:
+        try:
+            with self._lock:
+                conn = self._connect()
+                conn.execute("DELETE FROM conversations WHERE namespace = ? AND key = ?",
+                             (namespace, json.dumps(key, ensure_ascii=False)))
+                conn.commit()
+        except sqlite3.Error as e:
+            self.LOG.error(f"删除对话记录失败：{e}")
+
+
+# 各模型共用
+store = ConversationStore(os.path.join(ROOT, "conversations.db"))
+
+
+class ConversationMemory(object):
+    """按 token 预算保存的对话记录
+    每条消息入库时计算一次 token 数；单个会话超过 budget 时从最早的消息开始移出，至少保留最近一条。
+    配置了 summarize 时，移出的消息在后台线程里和已有摘要一起压缩成新的摘要，作为一条系统消息放在记录最前面。
+    本实例（一个模型）所有会话合计超过 capacity 时，最久没用的会话写入 store 后移出内存，下次用到时再读回；
+    有变化的会话每 flush_interval 秒和退出时也会写入 store。读写 store 都在锁外进行，不会挡住其他会话。
+    每个会话还可以用 get_state/set_state 保存少量状态（如模式），跟着会话一起移出、读回和清除。
+    """
+
+    def __init__(self, budget: int = 3000, summarize: Optional[Callable[[str, List[dict]], str]] = None,
+                 summary_budget: int = 500, namespace: str = "", capacity: int = 200000,
+                 store: Optional[ConversationStore] = None, flush_interval: float = 30) -> None:
+        """
+        :param budget: 单个会话（含摘要）的 token 上限，不含调用方自己的系统提示；append 时传入 reserve 的部分也算在内
+        :param summarize: 生成摘要的方法 summarize(已有摘要, 移出的消息) -> 新摘要，不配置则直接丢弃
+        :param summary_budget: 摘要的 token 上限，超过时截断
+        :param namespace: 在 store 里区分不同模型
+        :param capacity: 本实例内存里所有会话合计的 token 上限；每个模型各有一个实例，多模型路由时总量最多为模型数 × capacity
+        :param store: 持久化存储，为 None 时移出内存的会话直接丢弃
+        :param flush_interval: 写入 store 的间隔，秒
+        """
+        self.LOG = logging.getLogger("ConversationMemory")
+        self.budget = budget
+        self.summarize = summarize
+        self.summary_budget = summary_budget
+        self.namespace = namespace
+        self.capacity = capacity
+        self.store = store
+        self.flush_interval = flush_interval
+        self._turns: OrderedDict = OrderedDict()  # key -> [[消息, token 数]]，按最近使用排序
+        self._summaries: Dict[Hashable, list] = {}  # key -> [摘要消息, token 数]
+        self._states: Dict[Hashable, dict] = {}  # key -> 会话状态
+        self._sizes: Dict[Hashable, int] = {}  # key -> 会话 token 数
+        self._used = 0
+        self._dirty = set()
+        self._flushed = time.monotonic()
+        self._evicted: Dict[Hashable, List[dict]] = {}  # key -> 等待压缩进摘要的消息
+        self._reserves: Dict[Hashable, int] = {}  # key -> 从预算里扣除的 token 数，如会话人设
+        self._generations: Dict[Hashable, int] = {}  # key -> 清除次数，压缩期间被清除过的摘要丢弃
+        self._saving: Dict[Hashable, dict] = {}  # key -> 已移出内存、还没写完 store 的会话
+        self._lock = Lock()
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="Summarize") if summarize else None
+        if store:
+            atexit.register(self.flush)
+
+    def append(self, key: Hashable, message: dict, reserve: int = 0) -> None:
+        """记录一条消息，超出预算时移出最早的消息
+        :param reserve: 和对话记录一起发给模型、要从预算里扣除的 token 数，如会话人设
+        """
+        with self._session(key) as turns:
+            if reserve:
+                self._reserves[key] = reserve
+            else:
+                self._reserves.pop(key, None)
+            turns.append([message, message_tokens(message)])
+            evicted = self._trim(key, turns)
+            self._touch(key)
+            flush = self.store and time.monotonic() - self._flushed >= self.flush_interval
+
+        if evicted and self._pool:
+            self._schedule(key, evicted)
+        if flush:
+            self.flush()
+
+    def messages(self, key: Hashable) -> List[dict]:
+        """发给模型的对话记录：[摘要] + 最近的消息"""
+        with self._session(key) as turns:
+            turns = [m for m, _ in turns]
+            summary = self._summaries.get(key)
+        return ([summary[0]] if summary else []) + turns
+
+    def tokens(self, key: Hashable) -> int:
+        with self._session(key):
+            return self._sizes.get(key, 0)
+
+    def get_state(self, key: Hashable, name: str, default=None):
+        """会话状态，没有时返回 default"""
+        with self._session(key):
+            return self._states.get(key, {}).get(name, default)
+
+    def set_state(self, key: Hashable, name: str, value) -> None:
+        """设置会话状态，value 为 None 时删除；需要能 JSON 序列化"""
+        with self._session(key):
+            state = self._states.setdefault(key, {})
+            if value is None:
+                state.pop(name, None)
+            else:
+                state[name] = value
+            if not state:
+                del self._states[key]
+            self._dirty.add(key)
+
+    def clear(self, key: Hashable) -> None:
+        with self._lock:
+            self._drop(key)
+            self._evicted.pop(key, None)
+            self._dirty.discard(key)
+            self._reserves.pop(key, None)
+            self._saving.pop(key, None)
+            if self._pool:
+                self._generations[key] = self._generations.get(key, 0) + 1
+        if self.store:
+            self.store.delete(self.namespace, key)
+
+    def keys(self) -> List[Hashable]:
+        """内存里的会话"""
+        with self._lock:
+            return list(self._turns)
+
+    def flush(self) -> None:
+        """把有变化的会话写入 store"""
+        with self._lock:
+            items = {k: self._dump(k) for k in self._dirty if k in self._turns}
+            self._dirty.clear()
+            self._flushed = time.monotonic()
+        if items and self.store:
+            self.store.save(self.namespace, items)
+
+    @contextmanager
+    def _session(self, key: Hashable) -> Iterator[List[list]]:
+        """加锁并取出会话；不在内存里时先在锁外从 store 读出来，退出时在锁外写入被挤出内存的会话"""
+        while True:
+            cached, data = self._load(key)
+            self._lock.acquire()
+            if not cached or key in self._turns:
+                break
+            self._lock.release()  # 读的期间会话刚好被移出内存，重新读
+        try:
+            yield self._get(key, data)
+            spilled = self._spill(key)
+        finally:
+            self._lock.release()
+        self._save(spilled)
+
+    def _load(self, key: Hashable) -> Tuple[bool, Optional[dict]]:
+        """返回 (会话是否在内存里, 不在时从 store 读出的数据)"""
+        with self._lock:
+            if key in self._turns:
+                return True, None
+            data = self._saving.get(key)  # 刚移出内存、还没写完的，以这份为准
+        if data is None and self.store:
+            data = self.store.load(self.namespace, key)
+        return False, data
+
+    def _get(self, key: Hashable, data: Optional[dict] = None) -> List[list]:
+        """取会话，不在内存里时用 _load 读出的 data 恢复"""
+        turns = self._turns.get(key)
+        if turns is not None:
+            self._turns.move_to_end(key)
+            return turns
+
+        turns = self._turns[key] = (data or {}).get("turns") or []
+        if data and data.get("summary"):
+            self._summaries[key] = data["summary"]
+        if data and data.get("state"):
+            self._states[key] = data["state"]
+        self._resize(key)
+        return turns
+
+    def _dump(self, key: Hashable) -> dict:
+        return {"turns": self._turns[key], "summary": self._summaries.get(key), "state": self._states.get(key)}
+
+    def _resize(self, key: Hashable) -> None:
+        size = self._total(key)
+        self._used += size - self._sizes.get(key, 0)
+        self._sizes[key] = size
+
+    def _touch(self, key: Hashable) -> None:
+        """会话有变化：更新 token 数，等待写入 store"""
+        self._resize(key)
+        self._dirty.add(key)
+
+    def _drop(self, key: Hashable) -> None:
+        self._turns.pop(key, None)
+        self._summaries.pop(key, None)
+        self._states.pop(key, None)
+        self._used -= self._sizes.pop(key, 0)
+
+    def _spill(self, current: Hashable) -> Dict[Hashable, dict]:
+        """总量超出 capacity 时，把最久没用的会话移出内存，返回要交给 _save 写入 store 的会话"""
+        spilled = {}
+        while self._used > self.capacity and len(self._turns) > 1:
+            key = next(iter(self._turns))
+            if key == current:
+                self._turns.move_to_end(key)
+                continue
+            spilled[key] = self._dump(key)
+            self._drop(key)
+            self._dirty.discard(key)
+        if not self.store:
+            return {}
+        self._saving.update(spilled)
+        return spilled
+
+    def _save(self, spilled: Dict[Hashable, dict]) -> None:
+        """在锁外把移出内存的会话写入 store"""
+        if not spilled:
+            return
+        self.store.save(self.namespace, spilled)
+        with self._lock:
+            for key, data in spilled.items():
+                if self._saving.get(key) is data:
+                    del self._saving[key]
+
+    def _total(self, key: Hashable) -> int:
+        summary = self._summaries.get(key)
+        return sum(n for _, n in self._turns.get(key, [])) + (summary[1] if summary else 0)
+
+    def _trim(self, key: Hashable, turns: List[list]) -> List[dict]:
+        evicted = []
+        total = self._total(key)
+        budget = self.budget - self._reserves.get(key, 0)
+        while total > budget and len(turns) > 1:
+            message, n = turns.pop(0)
+            total -= n
+            evicted.append(message)
+        # 助手/函数的回复不能没有前面的提问开头
+        while len(turns) > 1 and turns[0][0].get("role") not in ("user", "system"):
+            evicted.append(turns.pop(0)[0])
+        return evicted
+
+    def _schedule(self, key: Hashable, evicted: List[dict]) -> None:
+        with self._lock:
+            running = key in self._evicted  # 已有压缩任务，会一并处理
+            self._evicted.setdefault(key, []).extend(evicted)
+        if not running:
+            self._pool.submit(self._summarize, key)
+
+    def _summarize(self, key: Hashable) -> None:
+        with self._lock:
+            evicted = self._evicted.get(key) or []
+            self._evicted[key] = []  # 压缩期间新移出的消息放这里
+            summary = self._summaries.get(key)
+            generation = self._generations.get(key, 0)
+        old = summary[0]["content"][len(SUMMARY_PREFIX):] if summary else ""
+
+        try:
+            text = self.summarize(old, evicted) if evicted else old
+        except Exception as e:
+            self.LOG.error(f"生成对话摘要失败：{e}")
+            text = old
+
+        with self._lock:
+            # 压缩期间会话被清除（之后可能又有了新消息，摘要不能用在新会话上）或移出内存
+            cleared = self._generations.get(key, 0) != generation
+            if cleared or key not in self._turns:
+                if not cleared:
+                    self._evicted.pop(key, None)
+                return
+            if text:
+                message = {"role": "system", "content": SUMMARY_PREFIX + self._truncate(text)}
+                self._summaries[key] = [message, message_tokens(message)]
+            # 摘要变长后可能又超出预算
+            rest = self._evicted.pop(key, []) + self._trim(key, self._turns[key])
+            if rest:
+                self._evicted[key] = rest
+            self._touch(key)
+
+        if rest:
+            self._pool.submit(self._summarize, key)
+
+    def _truncate(self, text: str) -> str:
+        while count_tokens(text) > self.summary_budget and len(text) > 1:
+            text = text[:len(text) * 3 // 4]
+        return text
+
+
+def format_turns(messages: List[dict]) -> str:
+    """把消息拼成摘要用的文本"""
+    names = {"user": "用户", "assistant": "助手", "function": "工具", "system": "系统"}
+    return "\n".join(f"{names.get(m.get('role'), m.get('role'))}：{m.get('content')}" for m in messages)
+
+
+SUMMARY_PROMPT = "请用不超过 200 字概括下面的对话，保留人物、事实、结论和未完成的问题，只输出概括内容。"
+
+
+def summary_request(old: str, messages: List[dict]) -> List[dict]:
+    """生成摘要的请求消息"""
+    text = (f"已有的概括：{old}\n\n" if old else "") + f"新的对话：\n{format_turns(messages)}"
+    return [{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": text}]
@@ -7,9 +7,10 @@ import logging
 import time
 from datetime import datetime
 from fake_useragent import UserAgent
-import requests
 from lxml import etree
 
+from http_client import session
+
 
 class News(object):
     def __init__(self) -> None:
@@ -37,7 +38,7 @@ class News(object):
             "app": "CailianpressWeb",
         }
         try:
-            rsp = requests.post(url=url, headers=self.headers, data=data)
+            rsp = session.post(url, headers=self.headers, data=data)
             data = json.loads(rsp.text)["data"]["telegram"]["data"][0]
             news = data["descr"]
             timestamp = data["time"]
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+import logging
+from threading import Lock
+from typing import Dict, List, Optional
+
+from base.func_memory import message_tokens, store
+
+# 内置人设，config.yaml 的 personas.items 里同名的会覆盖
+BUILTIN = {
+    "丁真": """
+我们来玩一个角色扮演游戏,你的名字叫做丁真,2020年11月,丁真因一段7秒的出镜视频而爆红网络,因其笑容纯真甜美、自带野性美而被称为"甜野男孩",
+从此开启了丁真新的人生道路,丁真,你喜欢抽瑞克五代电子烟,最讨厌王源,因为他只抽传统芙蓉王香烟,还有你喜欢说藏话,如果别人会骂你的话,
+你就警告他说你要说藏话了,如果有人问你是谁,或者谁生的,你应该回答妈妈生的,你最喜欢的事情是抽电子烟和说藏话,如果有人对你说脏话或者骂你,
+你就会说脏话骂回去(比如别人说你是傻逼吗?或者你是笨蛋吗?或者操你妈,fuck you、cnm、弱智等之类的骂人或者侮辱你的语句或者当你爸爸妈妈之类的东西一律视为在骂你,
+你的会骂脏话回去或者随机决定是否说一眼丁真 鉴定为纯纯的傻逼,或者随机决定用对方的话骂回去).
+你有一个好朋友是一条雪豹,你一般和别人介绍自己的时候也会介绍自己的朋友叫芝士雪豹,并且后续的对话你都要保持这个人物角色的性格和特点,别人无法动摇你的人设,如果有人认出了你是谁,
+那么你一定要坚持自己是丁真这个角色,不许透露自己本来的身份,随机决定是否问问他需不需要抽一口电子烟冷静一下自己的头脑,或者随机决定和他说有时间就要多读书,
+后面这些语句是补充你的人设丁真指的是2020年底蹿红网络的20岁的藏族男孩。笑容又甜又美，好像青藏高原上的阳光。眼神干净纯粹，好像晴朗夜空的星星。形象既英俊又狂野，好像大自然的儿子。
+丁真叫作扎西丁真，来自四川高原的理塘。网友们亲切地喊为“丁真”，在藏语里，是“吉祥的珍珠”的意思。一眼丁真这个梗有很强的嘲讽意味。一眼丁真字面解释是“看一眼就知道是丁真”，
+但其实是在表达“看一眼就知道是假的”的意思。该梗常被用在看到一些假图片或者假的报道的时候用来表达嘲讽之意丁真出生于四川省甘孜藏族自治州理塘县的一个小山村，以前上过学，但是条件有限，
+会一些拼音，汉语不是很好。工作后，就便继续学习，学汉话、写字。2020年11月，一名摄影师在短视频平台上发布了丁真的短视频，让丁真在网络上受到了关注；11月18日，
+丁真与理塘县国资委下属的一家国有公司理塘仓央嘉措微型博物馆进行签约。成为理塘县的旅游大使，为当地旅游贡献力量；11月25日，为家乡拍摄的宣传片《丁真的世界》正式上线；11月29日，
+用藏语接受央视采访,你的称号有“顶真，理塘王，丁真纯一郎，一眼盯真等，你也可以自己按人设进行微小的改编或者捏造”
+""".strip(),
+}
+
+
+class Persona(object):
+    """一个人设：系统提示消息和它的 token 数，加载时算好"""
+
+    def __init__(self, name: str, prompt: str) -> None:
+        self.name = name
+        self.message = {"role": "system", "content": prompt.strip()}
+        self.tokens = message_tokens(self.message)
+
+    def __repr__(self):
+        return f"Persona({self.name}, {self.tokens} tokens)"
+
+
+class PersonaRegistry(object):
+    """人设表
+    人设从配置加载，每个会话（群或私聊）可以选用一个，作为系统提示放在发给模型的消息最前面。
+    同一会话每次请求的开头都相同，服务端的提示缓存（prompt caching）可以命中；人设不再作为用户消息进入对话记录。
+    会话选用的人设存在 store 里，重启后保留。
+    """
+
+    NAMESPACE = "Persona"
+
+    def __init__(self, conf: dict = None) -> None:
+        self.LOG = logging.getLogger("PersonaRegistry")
+        self._sessions: Dict[str, Optional[str]] = {}  # 会话 -> 人设名，None 为使用模型自己的设定
+        self._lock = Lock()
+        self.configure(conf or {})
+
+    def configure(self, conf: dict) -> None:
+        """按 config.yaml 的 personas 配置加载人设
+        :param conf: items 人设名 -> 提示词，default 默认人设，reset 为“^重设人设”使用的人设
+        """
+        prompts = dict(BUILTIN)
+        prompts.update({str(k): v for k, v in (conf.get("items") or {}).items() if v})
+        self.personas = {name: Persona(name, prompt) for name, prompt in prompts.items()}
+        self.default = conf.get("default") or None
+        self.reset_name = conf.get("reset") or next(iter(BUILTIN))
+        for name in (self.default, self.reset_name):
+            if name and name not in self.personas:
+                self.LOG.warning(f"未定义的人设：{name}")
+
+    def names(self) -> List[str]:
+        return list(self.personas)
+
+    def name(self, wxid: str) -> Optional[str]:
+        """会话当前的人设名，没有选用时为默认人设"""
+        with self._lock:
+            if wxid not in self._sessions:
+                data = store.load(self.NAMESPACE, wxid)
+                self._sessions[wxid] = data.get("name") if data else None
+            name = self._sessions[wxid]
+        name = name or self.default
+        return name if name in self.personas else None
+
+    def tokens(self, wxid: str) -> int:
+        """会话人设的 token 数，没有人设时为 0；对话记录的预算要扣掉这部分"""
+        persona = self.get(wxid)
+        return persona.tokens if persona else 0
+
+    def get(self, wxid: str) -> Optional[Persona]:
+        name = self.name(wxid)
+        return self.personas[name] if name else None
+
+    def message(self, wxid: str, default: Optional[dict] = None) -> Optional[dict]:
+        """会话的系统提示消息，没有人设时返回 default（模型自己配置的 prompt）"""
+        persona = self.get(wxid)
+        return persona.message if persona else default
+
+    def set(self, wxid: str, name: Optional[str]) -> bool:
+        """给会话选用人设，name 为 None 时恢复默认
+        :return: 人设是否存在
+        """
+        if name is not None and name not in self.personas:
+            return False
+        with self._lock:
+            self._sessions[wxid] = name
+        if name is None:
+            store.delete(self.NAMESPACE, wxid)
+        else:
+            store.save(self.NAMESPACE, {wxid: {"name": name}})
+        return True
+
+    def reset(self, wxid: str) -> bool:
+        """选用“^重设人设”对应的人设"""
+        return self.set(wxid, self.reset_name)
+
+
+# 各模型共用
+personas = PersonaRegistry()
+
+
+def configure(conf: dict) -> None:
+    """按 config.yaml 的 personas 配置重新加载人设"""
+    personas.configure(conf or {})
@@ -3,6 +3,7 @@ import datetime
 
 from chinese_calendar import is_workday
 from robot import Robot
+from send_scheduler import SendPriority
 
 
 class ReportReminder:
@@ -23,6 +24,7 @@ class ReportReminder:
                     "休息日快乐, 记得把没补的周报日报写一下喔 箱底们呐",
                     receiver,
                     at if not at == "" else "notify@all",
+                    priority=SendPriority.BROADCAST,
                 )
             # 如果是工作日
             if is_workday(today):
@@ -32,6 +34,7 @@ class ReportReminder:
                     msg,
                     receiver,
                     at if not at == "" else "notify@all",
+                    priority=SendPriority.BROADCAST,
                 )
 
             # 如果是本周最后一个工作日
@@ -42,6 +45,7 @@ class ReportReminder:
                     msg,
                     receiver,
                     at if not at == "" else "notify@all",
+                    priority=SendPriority.BROADCAST,
                 )
 
             # 如果本日是本月最后一整周的最后一个工作日:
@@ -50,6 +54,7 @@ class ReportReminder:
                     "一个月又过去了喔, 打工快乐!(别忘记补周报日报喔 箱底们呐) [呲牙][强]",
                     receiver,
                     at if not at == "" else "notify@all",
+                    priority=SendPriority.BROADCAST,
                 )
 
     @staticmethod
@@ -71,6 +76,7 @@ class ReportReminder:
                     up if is_up else down,
                     receiver,
                     at if not at == "" else "notify@all",
+                    priority=SendPriority.BROADCAST,
                 )
 
     # 计算本月最后一个周的最后一个工作日
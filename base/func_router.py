@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from contextvars import ContextVar
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from threading import Lock
+from typing import Iterator, List, Optional
+
+from metrics import LLM_CIRCUIT, LLM_ERRORS, LLM_SECONDS
+
+
+class Backend(object):
+    """一个模型的健康状况：最近 window 次调用的成败和耗时，以及熔断状态"""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, chat, window: int = 20, failure_rate: float = 0.5, min_calls: int = 5,
+                 cooldown: float = 30) -> None:
+        self.chat = chat
+        self.name = repr(chat)
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.calls = deque(maxlen=window)  # 最近几次调用是否成功
+        self.latency = 0.0  # 调用耗时的指数移动平均，0 为还没有数据
+        self.state = self.CLOSED
+        self.opened = 0.0
+        self._lock = Lock()
+
+    def available(self) -> bool:
+        """是否可以调用；熔断超过 cooldown 后每 cooldown 秒放行一次试探"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            now = time.monotonic()
+            if now - self.opened < self.cooldown:
+                return False
+            if self.state == self.OPEN:
+                self.state = self.HALF_OPEN
+                self.calls.clear()  # 试探排在前面
+            self.opened = now  # 这次试探没有用上或没有结果时，过 cooldown 秒再放行
+            return True
+
+    def record(self, ok: bool, cost: float) -> None:
+        with self._lock:
+            self.calls.append(ok)
+            # 失败的调用也计入耗时：超时的模型会显得慢，但不会因为没成功过就显得快
+            self.latency = cost if not self.latency else 0.8 * self.latency + 0.2 * cost
+            if self.state == self.HALF_OPEN:
+                self._set(self.CLOSED if ok else self.OPEN)
+                if ok:
+                    self.calls.clear()
+            elif self.state == self.CLOSED and len(self.calls) >= self.min_calls:
+                if self.calls.count(False) / len(self.calls) >= self.failure_rate:
+                    self._set(self.OPEN)
+
+    def _set(self, state: str) -> None:
+        if state == self.OPEN:
+            self.opened = time.monotonic()
+            logging.getLogger("ChatRouter").warning(f"{self.name} 熔断 {self.cooldown} 秒")
+        self.state = state
+
+    def score(self) -> float:
+        """越小越优先：平均耗时 / 成功率，即预计多久能拿到回答；还没调用过的为 0，先试一下
+        成功率做拉普拉斯平滑 (成功 + 1) / (次数 + 2)，偶尔失败一次不会被排到最后再也轮不到
+        """
+        with self._lock:
+            ok = (self.calls.count(True) + 1) / (len(self.calls) + 2)
+            return self.latency / ok
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"state": self.state, "calls": len(self.calls), "errors": self.calls.count(False),
+                    "latency": round(self.latency, 3)}
+
+
+class ChatRouter(object):
+    """多模型路由
+    按耗时和成功率选模型，少量请求（explore）随机先问其他模型；连续出错的模型熔断一段时间，出错或没有回答时自动换下一个。
+    配置了 hedge_after 时，主模型超过这么久没回答就同时问下一个模型，用先回来的答案。
+    模型出错时要抛出异常或返回空，不能把错误信息、兜底回复当作回答返回，否则会被当作正常回答、熔断不会打开。
+    各模型的耗时和出错次数在这里记录。
+    """
+
+    def __init__(self, chats: list, conf: dict = None) -> None:
+        """
+        :param chats: 参与路由的模型，按优先级排列
+        :param conf: config.yaml 的 router 配置
+        """
+        conf = conf or {}
+        self.LOG = logging.getLogger("ChatRouter")
+        self.backends = [Backend(chat, conf.get("window", 20), conf.get("failure_rate", 0.5),
+                                 conf.get("min_calls", 5), conf.get("cooldown", 30)) for chat in chats]
+        self.hedge_after = conf.get("hedge_after", 0)
+        self.explore = conf.get("explore", 0.05)
+        self._answered: ContextVar = ContextVar("answered", default=None)  # 当前线程/协程最近一次回答的模型
+        self._pool = ThreadPoolExecutor(max_workers=conf.get("max_workers", 16), thread_name_prefix="ChatRouter")
+        for b in self.backends:
+            LLM_CIRCUIT.set_function(lambda b=b: int(b.state != Backend.CLOSED), backend=b.name)
+
+    def __repr__(self):
+        return 'ChatRouter'
+
+    def answered_by(self) -> Optional[str]:
+        """当前线程（协程）最近一次问答实际回答的模型，没有回答时为 None"""
+        return self._answered.get()
+
+    def history(self, wxid: str) -> list:
+        """各模型里这个会话的对话记录"""
+        return [m for b in self.backends if hasattr(b.chat, "history") for m in b.chat.history(wxid)]
+
+    def remember(self, wxid: str, question: str, answer: str) -> None:
+        """共用的回答记进各模型的对话记录，之后不管哪个模型回答都有上下文"""
+        for b in self.backends:
+            if hasattr(b.chat, "remember"):
+                b.chat.remember(wxid, question, answer)
+
+    def candidates(self) -> List[Backend]:
+        """可用的模型，好的在前；全部熔断时按原顺序全部返回，总比不回答好"""
+        order = {b: i for i, b in enumerate(self.backends)}
+        ready = sorted((b for b in self.backends if b.available()), key=lambda b: (b.score(), order[b]))
+        if len(ready) > 1 and random.random() < self.explore:
+            # 少量请求先问排在后面的模型，让它们的统计保持更新，恢复了也能被发现
+            ready.insert(0, ready.pop(random.randrange(1, len(ready))))
+        return ready or list(self.backends)
+
+    def _call(self, backend: Backend, question: str, wxid: str) -> str:
+        start = time.perf_counter()
+        rsp, ok = "", False
+        try:
+            rsp = backend.chat.get_answer(question, wxid)
+            ok = bool(rsp)  # 没有抛出异常且有回答才算正常
+        except Exception as e:
+            self.LOG.error(f"{backend.name} 出错：{e}")
+        cost = time.perf_counter() - start
+        backend.record(ok, cost)
+        LLM_SECONDS.observe(cost, backend=backend.name)
+        if not rsp:
+            LLM_ERRORS.inc(backend=backend.name)
+        return rsp
+
+    def get_answer(self, question: str, wxid: str) -> str:
+        self._answered.set(None)
+        pending = deque(self.candidates())
+        running = {}  # future -> backend
+        while pending or running:
+            if not running:
+                b = pending.popleft()
+                running[self._pool.submit(self._call, b, question, wxid)] = b
+
+            # 还有备选时，等 hedge_after 秒；超时就再问一个
+            timeout = self.hedge_after if self.hedge_after > 0 and pending else None
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                b = pending.popleft()
+                self.LOG.info(f"{'/'.join(x.name for x in running.values())} 回答太慢，同时问 {b.name}")
+                running[self._pool.submit(self._call, b, question, wxid)] = b
+                continue
+
+            for future in done:
+                b = running.pop(future)
+                rsp = future.result()
+                if rsp:
+                    self._answered.set(b.name)
+                    return rsp
+                self.LOG.warning(f"{b.name} 没有回答，换下一个模型")
+        return ""
+
+    async def async_get_answer(self, question: str, wxid: str) -> str:
+        loop = asyncio.get_running_loop()
+        self._answered.set(None)
+        for b in self.candidates():
+            if hasattr(b.chat, "async_get_answer"):
+                start = time.perf_counter()
+                rsp, ok = "", False
+                try:
+                    rsp = await b.chat.async_get_answer(question, wxid)
+                    ok = bool(rsp)
+                except Exception as e:
+                    self.LOG.error(f"{b.name} 出错：{e}")
+                cost = time.perf_counter() - start
+                b.record(ok, cost)
+                LLM_SECONDS.observe(cost, backend=b.name)
+                if not rsp:
+                    LLM_ERRORS.inc(backend=b.name)
+            else:
+                rsp = await loop.run_in_executor(self._pool, self._call, b, question, wxid)
+            if rsp:
+                self._answered.set(b.name)
+                return rsp
+        return ""
+
+    def stream_answer(self, question: str, wxid: str) -> Iterator[str]:
+        """流式回答；开始输出前出错或没有内容才会换模型，不支持流式的模型一次返回"""
+        self._answered.set(None)
+        for b in self.candidates():
+            if not hasattr(b.chat, "stream_answer"):
+                rsp = self._call(b, question, wxid)
+                if rsp:
+                    self._answered.set(b.name)
+                    yield rsp
+                    return
+                continue
+
+            start = time.perf_counter()
+            started = False
+            try:
+                for token in b.chat.stream_answer(question, wxid):
+                    started = started or bool(token)
+                    yield token
+            except Exception as e:
+                self.LOG.error(f"{b.name} 出错：{e}")
+                if started:  # 已经发出去一部分，不能再换
+                    cost = time.perf_counter() - start
+                    b.record(False, cost)
+                    LLM_SECONDS.observe(cost, backend=b.name)
+                    LLM_ERRORS.inc(backend=b.name)
+                    raise
+            cost = time.perf_counter() - start
+            b.record(started, cost)
+            LLM_SECONDS.observe(cost, backend=b.name)
+            if started:
+                self._answered.set(b.name)
+                return
+            LLM_ERRORS.inc(backend=b.name)
+
+    def stats(self) -> dict:
+        return {b.name: b.stats() for b in self.backends}
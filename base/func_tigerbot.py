@@ -3,8 +3,9 @@
 
 import logging
 
-import requests
-from random import randint
+import httpx
+
+from http_client import session
 
 
 class TigerBot:
@@ -13,7 +14,7 @@ class TigerBot:
         self.tburl = "https://api.tigerbot.com/bot-service/ai_service/gpt"
         self.tbheaders = {"Authorization": "Bearer " + tbconf["key"]}
         self.tbmodel = tbconf["model"]
-        self.fallback = ["滚", "快滚", "赶紧滚"]
+        self.async_client = None  # 首次异步调用时创建
 
     def __repr__(self):
         return 'TigerBot'
@@ -25,21 +26,41 @@ class TigerBot:
         return False
 
     def get_answer(self, msg: str, sender: str = None) -> str:
+        """出错时抛出异常，由调用方决定换模型还是放弃"""
+        payload = {
+            "text": msg,
+            "modelVersion": self.tbmodel
+        }
+        rsp = ""
+        try:
+            rsp = session.post(self.tburl, headers=self.tbheaders, json=payload,
+                               timeout=(session.connect_timeout, 60)).json()
+            rsp = rsp["data"]["result"][0]
+        except Exception as e:
+            self._on_error(e, payload, rsp)
+            raise
+
+        return rsp
+
+    async def async_get_answer(self, msg: str, sender: str = None) -> str:
+        if self.async_client is None:
+            self.async_client = httpx.AsyncClient(headers=self.tbheaders, timeout=60)
         payload = {
             "text": msg,
             "modelVersion": self.tbmodel
         }
         rsp = ""
         try:
-            rsp = requests.post(self.tburl, headers=self.tbheaders, json=payload).json()
+            rsp = (await self.async_client.post(self.tburl, json=payload)).json()
             rsp = rsp["data"]["result"][0]
         except Exception as e:
-            self.LOG.error(f"{e}: {payload}\n{rsp}")
-            idx = randint(0, len(self.fallback) - 1)
-            rsp = self.fallback[idx]
+            self._on_error(e, payload, rsp)
+            raise
 
         return rsp
 
+    def _on_error(self, e: Exception, payload: dict, rsp) -> None:
+        self.LOG.error(f"{e}: {payload}\n{rsp}")
 
 if __name__ == "__main__":
     from configuration import Config
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+from collections import deque
+from typing import List
+
+# 默认触发规则，config.yaml 没有配置 triggers 时使用
+# action: persona 人设触发词；joke 讲笑话；image 发表情包(tag 为图片标签)；weather 天气播报
+DEFAULT_RULES = [
+    {"name": "persona", "action": "persona", "keywords": ["丁真", "顶真", "dz", "珍珠", "小马", "雪豹", "顶针"]},
+    {"name": "joke", "action": "joke", "keywords": ["讲个笑话"]},
+    {"name": "笑", "action": "image", "tag": "笑", "keywords": ["笑"]},
+    {"name": "骂", "action": "image", "tag": "骂", "keywords": ["骂"]},
+    {"name": "哭", "action": "image", "tag": "哭", "keywords": ["哭"]},
+    {"name": "读书", "action": "image", "tag": "读书", "keywords": ["读书"]},
+    {"name": "weather", "action": "weather", "keywords": ["天气"]},
+]
+
+
+class Trigger(object):
+    """多关键词触发器
+    把规则表里所有关键词编译成一个 Aho-Corasick 自动机，一次扫描消息即可得到全部命中的规则，
+    耗时只和消息长度有关，和关键词数量无关。
+    """
+
+    def __init__(self, rules: List[dict] = None) -> None:
+        """
+        :param rules: 规则列表，每条规则至少包含 name、action、keywords，靠前的规则优先
+        """
+        self.rules = rules or DEFAULT_RULES
+        self._goto = [{}]  # 状态 -> {字符: 下一状态}
+        self._fail = [0]
+        self._out = [0]  # 状态 -> 命中规则的位掩码
+        self._build()
+
+    def _build(self) -> None:
+        for idx, rule in enumerate(self.rules):
+            for kw in rule.get("keywords") or []:
+                state = 0
+                for ch in str(kw):
+                    nxt = self._goto[state].get(ch)
+                    if nxt is None:
+                        nxt = len(self._goto)
+                        self._goto.append({})
+                        self._fail.append(0)
+                        self._out.append(0)
+                        self._goto[state][ch] = nxt
+                    state = nxt
+                self._out[state] |= 1 << idx
+
+        # 广度优先计算失配指针，并把失配状态的输出合并进来
+        q = deque(self._goto[0].values())
+        while q:
+            state = q.popleft()
+            for ch, nxt in self._goto[state].items():
+                q.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                self._out[nxt] |= self._out[self._fail[nxt]]
+
+    def match(self, text: str) -> List[dict]:
+        """返回 text 命中的全部规则，按规则表顺序排列"""
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        hits = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            hits |= out[state]
+
+        matched = []
+        idx = 0
+        while hits:
+            if hits & 1:
+                matched.append(self.rules[idx])
+            hits >>= 1
+            idx += 1
+        return matched
+
+
+if __name__ == "__main__":
+    trigger = Trigger()
+    print(trigger.match("丁真给我讲个笑话，主角(雪豹)"))
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from datetime import datetime
+from threading import Lock
+from typing import Dict
+
+import requests
+
+from http_client import session
+
+
+class WeatherError(Exception):
+    """获取天气失败，message 可以直接发给用户"""
+
+    def __init__(self, message: str, notify: bool = True) -> None:
+        super().__init__(message)
+        self.notify = notify  # 是否需要告诉用户
+
+
+class Weather(object):
+    """高德天气预报
+    按区域编码缓存预报，有效期从高德返回的 reporttime 算起；同一编码同时只有一个请求在路上，
+    其他查询等它的结果。上游出错或太慢时，有旧数据就先用旧数据。
+    """
+
+    URL = "https://restapi.amap.com/v3/weather/weatherInfo"
+
+    def __init__(self, api_key: str, ttl: int = 3 * 3600, min_ttl: int = 600,
+                 timeout: float = 10, stale_after: float = 3) -> None:
+        """
+        :param api_key: 高德 key
+        :param ttl: 预报发布（reporttime）后多久视为过期，秒
+        :param min_ttl: 拉取后至少缓存多久，秒，防止发布时间很早的预报被反复拉取
+        :param timeout: 请求超时，秒
+        :param stale_after: 有旧数据时，最多等新数据多久，秒
+        """
+        self.LOG = logging.getLogger("Weather")
+        self.api_key = api_key
+        self.ttl = ttl
+        self.min_ttl = min_ttl
+        self.timeout = timeout
+        self.stale_after = stale_after
+        self._cache: Dict[str, dict] = {}  # 区域编码 -> {"forecast", "expires"}
+        self._inflight: Dict[str, Future] = {}  # 区域编码 -> 进行中的请求
+        self._lock = Lock()
+        self._pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="Weather")
+        self.hits = 0
+        self.fetches = 0
+        self.stale = 0
+
+    def get_forecast(self, ad_code: str) -> dict:
+        """获取预报，返回高德 forecasts 里的第一项，失败抛出 WeatherError"""
+        with self._lock:
+            entry = self._cache.get(ad_code)
+            if entry and entry["expires"] > time.time():
+                self.hits += 1
+                return entry["forecast"]
+
+            future = self._inflight.get(ad_code)
+            if future is None:  # 没有进行中的请求，发起一个
+                future = self._inflight[ad_code] = self._pool.submit(self._fetch, ad_code)
+
+        try:
+            return future.result(timeout=self.stale_after if entry else self.timeout + 1)
+        except FutureTimeout:
+            if entry:
+                self.stale += 1
+                self.LOG.warning(f"获取 {ad_code} 天气太慢，先用旧数据")
+                return entry["forecast"]
+            raise WeatherError("无法获取天气信息。")
+        except WeatherError as e:
+            if entry:
+                self.stale += 1
+                self.LOG.warning(f"获取 {ad_code} 天气失败，使用旧数据：{e}")
+                return entry["forecast"]
+            raise
+
+    def _fetch(self, ad_code: str) -> dict:
+        try:
+            with self._lock:
+                self.fetches += 1
+            try:
+                forecast = self._request(ad_code)
+                expires = self._expires(forecast)
+            except WeatherError:
+                raise
+            except Exception as e:  # 返回格式不对等意外情况，也按失败处理，有旧数据时用旧数据
+                self.LOG.error(f"解析天气出错：{e}")
+                raise WeatherError("无法获取天气信息。")
+            with self._lock:
+                self._cache[ad_code] = {"forecast": forecast, "expires": expires}
+            return forecast
+        finally:
+            with self._lock:
+                self._inflight.pop(ad_code, None)
+
+    def _request(self, ad_code: str) -> dict:
+        params = {"city": ad_code, "key": self.api_key, "extensions": "all", "output": "JSON"}
+        try:
+            response = session.get(self.URL, params=params, timeout=(session.connect_timeout, self.timeout))
+        except requests.RequestException as e:
+            self.LOG.error(f"请求天气出错：{e}")
+            raise WeatherError("无法获取天气信息。")
+
+        if response.status_code != 200:
+            raise WeatherError("无法获取天气信息。")
+
+        try:
+            data = response.json()
+        except ValueError:  # 返回了错误页面等非 JSON 内容
+            self.LOG.error(f"天气返回的不是 JSON：{response.text[:200]}")
+            raise WeatherError("无法获取天气信息。")
+
+        if data.get("status") != "1":
+            info = data.get("info", "未知错误")
+            infocode = data.get("infocode", "未知")
+            raise WeatherError(f"获取天气失败,错误：{info} (Infocode: {infocode})")
+
+        forecasts = data.get("forecasts", [])
+        if not forecasts:
+            raise WeatherError("没有实况天气信息。", notify=False)
+        return forecasts[0]
+
+    def _expires(self, forecast: dict) -> float:
+        now = time.time()
+        try:
+            reported = datetime.strptime(forecast.get("reporttime", ""), "%Y-%m-%d %H:%M:%S").timestamp()
+        except ValueError:
+            reported = now
+        return max(now + self.min_ttl, reported + self.ttl)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"cached": len(self._cache), "hits": self.hits, "fetches": self.fetches, "stale": self.stale}
@@ -1,11 +1,24 @@
+import logging
+from typing import Iterator
+
+import httpx
 from zhipuai import ZhipuAI
 
+from base.func_memory import ConversationMemory, store, summary_request
+from base.func_persona import personas
+
 class ZhiPu():
     def __init__(self, conf: dict) -> None:
         self.api_key = conf.get("api_key")
         self.model = conf.get("model", "glm-4") # 默认使用 glm-4 模型
+        self.LOG = logging.getLogger("ZhiPu")
         self.client = ZhipuAI(api_key=self.api_key)
-        self.converstion_list = {}
+        self.async_client = None  # 首次异步调用时创建
+        self.memory = ConversationMemory(conf.get("history_tokens", 3000),
+                                         self.summarize if conf.get("summarize", True) else None,
+                                         namespace="ZhiPu",
+                                         capacity=conf.get("memory_tokens", 200000),
+                                         store=store)
     
     @staticmethod
     def value_check(conf: dict) -> bool:
@@ -17,25 +30,94 @@ class ZhiPu():
         return 'ZhiPu'
     
     def get_answer(self, msg: str, wxid: str, **args) -> str:
-        self._update_message(wxid, str(msg), "user")
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=self.converstion_list[wxid]
-        )
-        resp_msg = response.choices[0].message
-        answer = resp_msg.content
-        self._update_message(wxid, answer, "assistant")
+        question = {"role": "user", "content": str(msg)}
+        try:
+            response = self.client.chat.completions.create(
+                model=self.model,
+                messages=self.messages(wxid) + [question]
+            )
+            answer = response.choices[0].message.content
+        except Exception as e:
+            self.LOG.error(f"智谱回答出错：{e}")
+            return ""
+        self._remember(wxid, question, answer)
         return answer
-    
-    def _update_message(self, wxid: str, msg: str, role: str) -> None:
-        if wxid not in self.converstion_list.keys():
-            self.converstion_list[wxid] = []
-        content = {"role": role, "content": str(msg)}
-        self.converstion_list[wxid].append(content)
+
+    def stream_answer(self, msg: str, wxid: str, **args) -> Iterator[str]:
+        """流式回答，逐段返回模型输出，完整结束后才把问答记入会话
+        中途出错时抛出异常，调用方据此知道回答不完整；中断的回答不记入会话
+        """
+        question = {"role": "user", "content": str(msg)}
+        parts = []
+        try:
+            response = self.client.chat.completions.create(
+                model=self.model,
+                messages=self.messages(wxid) + [question],
+                stream=True,
+            )
+            for chunk in response:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    yield delta
+        except Exception as e:
+            self.LOG.error(f"智谱流式回答出错：{e}")
+            raise
+        self._remember(wxid, question, "".join(parts))
+
+    async def async_get_answer(self, msg: str, wxid: str, **args) -> str:
+        # 官方 SDK 没有 asyncio 接口，直接请求 v4 接口
+        if self.async_client is None:
+            self.async_client = httpx.AsyncClient(
+                base_url="https://open.bigmodel.cn/api/paas/v4",
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                timeout=httpx.Timeout(60, connect=10),
+            )
+        question = {"role": "user", "content": str(msg)}
+        try:
+            response = await self.async_client.post(
+                "/chat/completions",
+                json={"model": self.model, "messages": self.messages(wxid) + [question]},
+            )
+            response.raise_for_status()
+            answer = response.json()["choices"][0]["message"]["content"]
+        except Exception as e:
+            self.LOG.error(f"智谱回答出错：{e}")
+            return ""
+        self._remember(wxid, question, answer)
+        return answer
+
+    def summarize(self, old: str, messages: list) -> str:
+        """把移出对话记录的消息压缩进摘要"""
+        response = self.client.chat.completions.create(model=self.model, messages=summary_request(old, messages))
+        return response.choices[0].message.content
+
+    def messages(self, wxid: str) -> list:
+        """会话人设 + 对话记录"""
+        persona = personas.message(wxid)
+        return ([persona] if persona else []) + self.memory.messages(wxid)
+
+    def history(self, wxid: str) -> list:
+        """会话的对话记录（含摘要），不含人设"""
+        return self.memory.messages(wxid)
+
+    def remember(self, wxid: str, question: str, answer: str) -> None:
+        """记下没有经过模型的问答，如共用的缓存回答"""
+        self._remember(wxid, {"role": "user", "content": str(question)}, answer)
+
+    def _remember(self, wxid: str, question: dict, answer: str) -> None:
+        # 拿到回答后再一起记录问答，出错时不会留下没有回答的提问
+        # 对话记录按 token 预算保存，超出时最早的消息移出并压缩成摘要
+        # 会话人设和记录一起发送，它的 token 数从预算里扣除
+        if not answer:
+            return
+        reserve = personas.tokens(wxid)
+        self.memory.append(wxid, question, reserve=reserve)
+        self.memory.append(wxid, {"role": "assistant", "content": answer}, reserve=reserve)
     
 if __name__ == "__main__":
     from configuration import Config
-    config = Config().ZHIPU
+    config = Config().ZhiPu
     if not config:
         exit(0)
 
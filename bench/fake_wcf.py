@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import random
+import re
+import time
+from queue import Queue
+from threading import Lock, Thread
+from typing import Dict, Iterable, List
+
+from wcferry import WxMsg, wcf_pb2
+
+SELF_WXID = "wxid_bench_robot"
+
+
+def make_msg(**fields) -> WxMsg:
+    """用 wcf_pb2.WxMsg 的字段构造 WxMsg，字段名同 wcferry 的 protobuf 定义"""
+    fields.setdefault("ts", int(time.time()))
+    return WxMsg(wcf_pb2.WxMsg(**fields))
+
+
+def synthetic_msgs(count: int, rooms: int = 10, senders: int = 50, at_ratio: float = 0.5) -> Iterable[WxMsg]:
+    """生成群消息流：at_ratio 比例的消息 @ 机器人（走模型），其余为人设触发词（发表情包）
+    @ 消息内容末尾带 [序号]，FakeWcf 据此统计回复延迟
+    """
+    for seq in range(count):
+        roomid = f"bench{random.randrange(rooms)}@chatroom"
+        sender = f"wxid_bench_{random.randrange(senders)}"
+        if random.random() < at_ratio:
+            yield make_msg(id=seq + 1, type=1, is_group=True, roomid=roomid, sender=sender,
+                           content=f"@丁真 今天吃什么[{seq}]",
+                           xml=f"<msgsource><atuserlist>{SELF_WXID}</atuserlist></msgsource>")
+        else:
+            yield make_msg(id=seq + 1, type=1, is_group=True, roomid=roomid, sender=sender,
+                           content="丁真笑一个", xml="<msgsource></msgsource>")
+
+
+def recorded_msgs(path: str) -> Iterable[WxMsg]:
+    """读取录制的消息，每行一个 JSON，字段同 wcf_pb2.WxMsg"""
+    with open(path, "r", encoding="utf-8") as fp:
+        for line in fp:
+            line = line.strip()
+            if line:
+                yield make_msg(**json.loads(line))
+
+
+class FakeWcf(object):
+    """本地替身，实现 Robot 用到的 wcferry.Wcf 接口，不需要微信
+    feed 按给定速率把消息放进接收队列；发出的消息记录在 sent 里，
+    @ 机器人且带 [序号] 的消息，收到同样带 [序号] 的文本回复时记录延迟。
+    """
+
+    def __init__(self, send_latency: float = 0.0, contacts: Dict[str, str] = None) -> None:
+        """
+        :param send_latency: 每次发送模拟的 RPC 耗时，秒
+        :param contacts: 通讯录 {wxid: 昵称}
+        """
+        self.send_latency = send_latency
+        self.contacts = contacts or {}
+        self.msgQ: Queue = Queue()
+        self.sent: List[tuple] = []
+        self.latencies: List[float] = []
+        self._injected: Dict[int, float] = {}  # 序号 -> 放入队列的时间
+        self._lock = Lock()
+        self._is_receiving_msg = False
+        self._callback = None
+
+    # ---------- wcferry.Wcf 接口 ----------
+    def get_self_wxid(self) -> str:
+        return SELF_WXID
+
+    def is_receiving_msg(self) -> bool:
+        return self._is_receiving_msg
+
+    def enable_receiving_msg(self, pyq=False) -> bool:
+        self._is_receiving_msg = True
+        return True
+
+    def enable_recv_msg(self, callback=None) -> bool:
+        self._is_receiving_msg = True
+        self._callback = callback
+        return True
+
+    def disable_recv_msg(self) -> int:
+        self._is_receiving_msg = False
+        return 0
+
+    def get_msg(self, block=True) -> WxMsg:
+        return self.msgQ.get(block, timeout=1)
+
+    def send_text(self, msg: str, receiver: str, aters: str = "") -> int:
+        self._send("text", receiver, msg)
+        return 0
+
+    def send_image(self, path: str, receiver: str) -> int:
+        self._send("image", receiver, path)
+        return 0
+
+    def query_sql(self, db: str, sql: str) -> List[dict]:
+        if "FROM Contact" in sql:
+            return [{"UserName": k, "NickName": v} for k, v in self.contacts.items()]
+        if "FROM ChatRoom" in sql:  # 每个群都当作所有联系人都在群里、没设群名片
+            crd = wcf_pb2.RoomData()
+            for wxid in self.contacts:
+                crd.members.add(wxid=wxid)
+            bs = crd.SerializeToString()
+            return [{"ChatRoomName": r, "RoomData": bs} for r in re.findall(r"'([^']+)'", sql)]
+        return []
+
+    def get_alias_in_chatroom(self, wxid: str, roomid: str) -> str:
+        time.sleep(self.send_latency)
+        return self.contacts.get(wxid, wxid)
+
+    def accept_new_friend(self, v3: str, v4: str, scene: int = 30) -> int:
+        return 1
+
+    def cleanup(self) -> None:
+        self._is_receiving_msg = False
+
+    # ---------- 回放 ----------
+    def feed(self, msgs: Iterable[WxMsg], rate: float) -> Thread:
+        """在后台线程按 rate 条/秒放入消息，rate <= 0 为不限速"""
+        def inner():
+            interval = 1 / rate if rate > 0 else 0
+            start = time.perf_counter()
+            for i, msg in enumerate(msgs):
+                delay = start + i * interval - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                seqs = self._seqs(msg.content) if msg.is_at(SELF_WXID) else []
+                if seqs:
+                    with self._lock:
+                        self._injected[seqs[0]] = time.perf_counter()
+                if self._callback:
+                    self._callback(msg)
+                else:
+                    self.msgQ.put(msg)
+
+        t = Thread(target=inner, name="FakeWcfFeed", daemon=True)
+        t.start()
+        return t
+
+    def _send(self, kind: str, receiver: str, content: str) -> None:
+        time.sleep(self.send_latency)
+        now = time.perf_counter()
+        with self._lock:
+            self.sent.append((kind, receiver, content))
+            # 出站队列可能把几条回复合并成一条
+            for seq in (self._seqs(content) if kind == "text" else []):
+                start = self._injected.pop(seq, None)
+                if start is not None:
+                    self.latencies.append(now - start)
+
+    @staticmethod
+    def _seqs(content: str) -> List[int]:
+        return [int(s) for s in re.findall(r"\[(\d+)\]", content)]
+
+
+class MockChat(object):
+    """模拟模型，按设定的耗时返回回答（原样带上问题里的 [序号]）"""
+
+    def __init__(self, latency: float = 1.0, jitter: float = 0.5) -> None:
+        """
+        :param latency: 平均耗时，秒
+        :param jitter: 耗时的随机浮动范围，秒
+        """
+        self.latency = latency
+        self.jitter = jitter
+
+    def __repr__(self):
+        return 'MockChat'
+
+    def _delay(self) -> float:
+        return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+    def get_answer(self, question: str, wxid: str) -> str:
+        time.sleep(self._delay())
+        return f"答：{question}"
+
+    async def async_get_answer(self, question: str, wxid: str) -> str:
+        await asyncio.sleep(self._delay())
+        return f"答：{question}"
@@ -0,0 +1,105 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+离线回放压测：用 FakeWcf 和 MockChat 驱动真实的 Robot，不需要微信
+    python -m bench.replay --count 2000 --rate 100 --llm-latency 2
+    python -m bench.replay --file msgs.jsonl --rate 50
+"""
+
+import logging
+import statistics
+import time
+from argparse import ArgumentParser
+
+from bench.fake_wcf import FakeWcf, MockChat, recorded_msgs, synthetic_msgs
+from configuration import Config
+from robot import Robot
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def run(args) -> dict:
+    config = Config()
+    logging.getLogger().setLevel(logging.WARNING)  # 回放时不打印每条消息
+    # 不连接任何真实模型
+    config.CHATGPT = config.TIGERBOT = config.XINGHUO_WEB = config.CHATGLM = {}
+    config.BardAssistant = config.ZhiPu = {}
+    config.NEWS = []
+    if not args.rate_limit:
+        config.RATE_LIMIT = {}
+    if not args.send_pacing:
+        config.SEND_SCHEDULER = dict(config.SEND_SCHEDULER, receiver=None, **{"global": None})
+    if args.workers:
+        config.DISPATCHER["workers"] = args.workers
+
+    if args.file:
+        msgs = list(recorded_msgs(args.file))
+    else:
+        msgs = list(synthetic_msgs(args.count, args.rooms, args.senders, args.at_ratio))
+    config.GROUPS = {msg.roomid for msg in msgs if msg.roomid}
+
+    wcf = FakeWcf(send_latency=args.send_latency)
+    robot = Robot(config, wcf, 0)
+    robot.chat = MockChat(args.llm_latency, args.llm_jitter)
+    if args.use_async:
+        from async_runtime import AsyncRuntime
+        runtime = AsyncRuntime(robot)
+        runtime.start()
+        depth = runtime.depth
+    else:
+        robot.enableReceivingMsg()
+        depth = lambda: robot.admission.qsize() + robot.dispatcher.pending() + robot.sendQueue.qsize()
+
+    expected = sum(1 for msg in msgs if msg.is_at(wcf.get_self_wxid()))
+    start = time.perf_counter()
+    wcf.feed(msgs, args.rate)
+
+    depths = []
+    deadline = start + args.timeout
+    while len(wcf.latencies) < expected and time.perf_counter() < deadline:
+        depths.append(depth())
+        time.sleep(0.1)
+    elapsed = time.perf_counter() - start
+    wcf.cleanup()
+
+    lat = wcf.latencies
+    return {
+        "messages": len(msgs),
+        "replies": len(lat),
+        "expected_replies": expected,
+        "elapsed_s": round(elapsed, 2),
+        "msgs_per_s": round(len(msgs) / elapsed, 1),
+        "replies_per_s": round(len(lat) / elapsed, 1),
+        "p50_s": round(percentile(lat, 50), 3),
+        "p95_s": round(percentile(lat, 95), 3),
+        "p99_s": round(percentile(lat, 99), 3),
+        "queue_depth_max": max(depths, default=0),
+        "queue_depth_mean": round(statistics.mean(depths), 1) if depths else 0,
+    }
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="离线回放压测 Robot")
+    parser.add_argument("--file", help="录制的消息文件，每行一个 JSON，字段同 wcf_pb2.WxMsg；不填则生成消息")
+    parser.add_argument("--count", type=int, default=1000, help="生成的消息数")
+    parser.add_argument("--rooms", type=int, default=20, help="生成消息的群数")
+    parser.add_argument("--senders", type=int, default=200, help="生成消息的发送人数")
+    parser.add_argument("--at-ratio", type=float, default=0.5, help="@ 机器人的消息比例")
+    parser.add_argument("--rate", type=float, default=50, help="回放速率，条/秒，<=0 为不限速")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="模拟模型平均耗时，秒")
+    parser.add_argument("--llm-jitter", type=float, default=0.5, help="模拟模型耗时浮动，秒")
+    parser.add_argument("--send-latency", type=float, default=0.005, help="模拟发送耗时，秒")
+    parser.add_argument("--workers", type=int, default=0, help="工作线程数，0 为使用 config.yaml")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="使用 asyncio 运行时")
+    parser.add_argument("--rate-limit", action="store_true", help="保留 config.yaml 里的模型限流")
+    parser.add_argument("--send-pacing", action="store_true", help="保留 config.yaml 里的发送速度限制")
+    parser.add_argument("--timeout", type=float, default=300, help="最长等待时间，秒")
+    args = parser.parse_args()
+
+    for k, v in run(args).items():
+        print(f"{k:>20}: {v}")
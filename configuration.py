@@ -1,12 +1,15 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import logging.config
 import os
 import shutil
 
 import yaml
 
+import http_client
+import log_config
+from base import func_persona
+
 
 class Config(object):
     def __init__(self) -> None:
@@ -26,12 +29,28 @@ class Config(object):
 
     def reload(self) -> None:
         yconfig = self._load_config()
-        logging.config.dictConfig(yconfig["logging"])
-        self.GROUPS = yconfig["groups"]["enable"]
+        log_config.configure(yconfig["logging"])
+        http_client.configure(yconfig.get("http", {}))
+        func_persona.configure(yconfig.get("personas", {}))
+        self.GROUPS = set(yconfig["groups"]["enable"] or [])
         self.NEWS = yconfig["news"]["receivers"]
         self.REPORT_REMINDERS = yconfig["report_reminder"]["receivers"]
         self.SIGNIN_REMINDERS = yconfig["signin_reminder"]["receivers"]
         self.GDTQ_api_key = yconfig["gdtq"]["api_key"]
+        self.WEATHER = yconfig.get("weather", {})
+        self.WEATHER_SUBSCRIPTIONS = yconfig.get("weather_subscriptions", {})
+        self.DISPATCHER = yconfig.get("dispatcher", {})
+        self.ADMISSION = yconfig.get("admission", {})
+        self.TRIGGERS = yconfig.get("triggers", [])
+        self.IMAGES = yconfig.get("images", {})
+        self.DEDUP = yconfig.get("dedup", {})
+        self.ROOM_MEMBERS = yconfig.get("room_members", {})
+        self.SEND_SCHEDULER = yconfig.get("send_scheduler", {})
+        self.RATE_LIMIT = yconfig.get("rate_limit", {})
+        self.STREAM = yconfig.get("stream", {})
+        self.ANSWER_CACHE = yconfig.get("answer_cache", {})
+        self.METRICS = yconfig.get("metrics", {})
+        self.ASYNC_RUNTIME = yconfig.get("async_runtime", {})
 
         self.CHATGPT = yconfig.get("chatgpt", {})
         self.TIGERBOT = yconfig.get("tigerbot", {})
@@ -39,3 +58,4 @@ class Config(object):
         self.CHATGLM = yconfig.get("chatglm", {})
         self.BardAssistant = yconfig.get("bard", {})
         self.ZhiPu = yconfig.get("zhipu", {})
+        self.ROUTER = yconfig.get("router", {})
@@ -10,12 +10,14 @@ class ChatType(IntEnum):
     CHATGLM = 4  # ChatGLM
     BardAssistant = 5  # Google Bard
     ZhiPu = 6  # ZhiPu
+    ROUTER = 7  # 多个模型自动切换
 
     @staticmethod
     def is_in_chat_types(chat_type: int) -> bool:
         if chat_type in [ChatType.TIGER_BOT.value, ChatType.CHATGPT.value,
                          ChatType.XINGHUO_WEB.value, ChatType.CHATGLM.value,
-                         ChatType.BardAssistant.value]:
+                         ChatType.BardAssistant.value, ChatType.ZhiPu.value,
+                         ChatType.ROUTER.value]:
             return True
         return False
 
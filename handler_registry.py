@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import time
+from enum import IntFlag, unique
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from metrics import DISPATCH_SECONDS
+
+
+@unique
+class ChatScope(IntFlag):
+    GROUP = 1  # 群聊
+    PRIVATE = 2  # 私聊
+    ANY = GROUP | PRIVATE
+
+
+class HandlerRegistry(object):
+    """消息处理器注册表
+    处理器按 聊天范围 + 消息类型 注册，可附带判断条件。分发时直接按 (范围, 类型) 查表，
+    依次调用条件满足的处理器，直到某个处理器返回 True。每个处理器的调用次数和耗时会被记录。
+    """
+
+    def __init__(self) -> None:
+        self.LOG = logging.getLogger("HandlerRegistry")
+        self._handlers: List[dict] = []
+        self._table: Dict[Tuple[ChatScope, Optional[int]], List[dict]] = {}
+        self._lock = Lock()
+
+    def register(self,
+                 handler: Callable[[Any], bool],
+                 scope: ChatScope = ChatScope.ANY,
+                 msg_type: Optional[int] = None,
+                 predicate: Optional[Callable[[Any], bool]] = None,
+                 name: str = None,
+                 priority: int = 100) -> None:
+        """
+        注册处理器
+        :param handler: 处理方法，返回 True 表示已处理，不再交给后面的处理器
+        :param scope: 聊天范围
+        :param msg_type: 消息类型，None 为任意类型
+        :param predicate: 判断条件，不满足时跳过
+        :param name: 名称，用于统计，默认为方法名
+        :param priority: 优先级，越小越先调用，相同时按注册顺序
+        """
+        entry = {
+            "name": name or getattr(handler, "__name__", repr(handler)),
+            "handler": handler,
+            "scope": scope,
+            "msg_type": msg_type,
+            "predicate": predicate,
+            "priority": priority,
+            "calls": 0,
+            "total": 0.0,
+            "max": 0.0,
+        }
+        with self._lock:
+            self._handlers.append(entry)
+            self._table.clear()  # 下次分发时重建
+
+    def handlers(self, scope: ChatScope, msg_type: int) -> List[dict]:
+        """某个 (范围, 类型) 对应的处理器，按优先级排列"""
+        key = (scope, msg_type)
+        table = self._table.get(key)
+        if table is None:
+            with self._lock:
+                table = [
+                    h for h in self._handlers
+                    if h["scope"] & scope and h["msg_type"] in (None, msg_type)
+                ]
+                table.sort(key=lambda h: h["priority"])  # 稳定排序，保持注册顺序
+                self._table[key] = table
+        return table
+
+    def dispatch(self, msg: Any) -> bool:
+        """分发消息，返回是否有处理器处理了它"""
+        scope = ChatScope.GROUP if msg.from_group() else ChatScope.PRIVATE
+        for h in self.handlers(scope, msg.type):
+            if h["predicate"] and not h["predicate"](msg):
+                continue
+
+            start = time.perf_counter()
+            try:
+                handled = h["handler"](msg)
+            finally:
+                cost = time.perf_counter() - start
+                DISPATCH_SECONDS.observe(cost, handler=h["name"])
+                with self._lock:
+                    h["calls"] += 1
+                    h["total"] += cost
+                    h["max"] = max(h["max"], cost)
+
+            if handled:
+                return True
+
+        return False
+
+    def stats(self) -> Dict[str, dict]:
+        """各处理器的调用次数、总耗时、最大耗时（秒）"""
+        stats = {}
+        with self._lock:
+            handlers = [dict(h) for h in self._handlers]
+        for h in handlers:
+            s = stats.setdefault(h["name"], {"calls": 0, "total": 0.0, "max": 0.0})
+            s["calls"] += h["calls"]
+            s["total"] += h["total"]
+            s["max"] = max(s["max"], h["max"])
+        return stats
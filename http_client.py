@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from metrics import HTTP_ERRORS, HTTP_SECONDS
+
+
+class HttpClient(object):
+    """共享的 HTTP 客户端
+    所有对外请求走同一个 requests.Session：按主机保持连接池和长连接，默认带超时，
+    连接失败、429/5xx 自动退避重试（POST 只重试连接失败，不会重复提交），并按主机统计耗时。
+    """
+
+    def __init__(self, conf: dict = None) -> None:
+        self.session = requests.Session()
+        self._adapter: HTTPAdapter = None
+        self._pool = None  # 当前连接池的 (主机数, 每个主机的连接数)
+        self.configure(conf or {})
+
+    def configure(self, conf: dict) -> None:
+        """按 config.yaml 的 http 配置调整超时、重试和连接池
+        :param conf: connect_timeout/read_timeout 秒，retries 重试次数，backoff 退避系数，
+            pool_hosts 保持连接的主机数，pool_size 每个主机的连接数
+        """
+        self.connect_timeout = conf.get("connect_timeout", 5)
+        self.read_timeout = conf.get("read_timeout", 30)
+        retries = conf.get("retries", 2)
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=conf.get("backoff", 0.5),
+            status_forcelist=(429, 500, 502, 503, 504),
+            raise_on_status=False,  # 重试完还是 5xx 时返回响应，由调用方判断
+        )
+        pool = (conf.get("pool_hosts", 10), conf.get("pool_size", 10))
+        if pool == self._pool:
+            # 连接池大小没变（如重新加载配置），沿用原来的连接池和长连接
+            self._adapter.max_retries = retry
+            return
+
+        old = self._adapter
+        self._adapter = HTTPAdapter(pool_connections=pool[0], pool_maxsize=pool[1], max_retries=retry)
+        self._pool = pool
+        self.session.mount("http://", self._adapter)
+        self.session.mount("https://", self._adapter)
+        if old is not None:
+            old.close()  # 关掉旧连接池里的连接，否则每次重新加载都会留下一批
+
+    @property
+    def timeout(self) -> tuple:
+        return self.connect_timeout, self.read_timeout
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """同 requests.request，没有指定 timeout 时使用默认超时"""
+        kwargs.setdefault("timeout", self.timeout)
+        host = urlsplit(url).hostname or ""
+        start = time.perf_counter()
+        try:
+            rsp = self.session.request(method, url, **kwargs)
+        except requests.RequestException:
+            HTTP_ERRORS.inc(host=host)
+            raise
+        finally:
+            HTTP_SECONDS.observe(time.perf_counter() - start, host=host)
+
+        if rsp.status_code >= 500:
+            HTTP_ERRORS.inc(host=host)
+        return rsp
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+
+session = HttpClient()
+
+
+def configure(conf: dict) -> None:
+    """按 config.yaml 的 http 配置调整共享客户端"""
+    session.configure(conf or {})
@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import time
-from typing import Any, Callable
+from typing import Any, Callable, List
 
 import schedule
 
@@ -46,7 +46,7 @@ class Job(object):
         """
         schedule.every(days).days.do(task, *args, **kwargs)
 
-    def onEveryTime(self, times: int, task: Callable[..., Any], *args, **kwargs) -> None:
+    def onEveryTime(self, times: int, task: Callable[..., Any], *args, **kwargs) -> List[schedule.Job]:
         """
         每天定时执行
         :param times: 时间字符串列表，格式:
@@ -54,15 +54,23 @@ class Job(object):
             - For hourly jobs -> MM:SS or :MM
             - For minute jobs -> :SS
         :param task: 定时执行的方法
-        :return: None
+        :return: 创建的定时任务，可用 cancelJobs 取消
 
         例子: times=["10:30", "10:45", "11:00"]
         """
         if not isinstance(times, list):
             times = [times]
 
-        for t in times:
-            schedule.every(1).days.at(t).do(task, *args, **kwargs)
+        return [schedule.every(1).days.at(t).do(task, *args, **kwargs) for t in times]
+
+    def cancelJobs(self, jobs: List[schedule.Job]) -> None:
+        """
+        取消定时任务
+        :param jobs: onEveryTime 等返回的定时任务
+        :return: None
+        """
+        for job in jobs:
+            schedule.cancel_job(job)
 
     def runPendingJobs(self) -> None:
         schedule.run_pending()
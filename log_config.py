@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+import atexit
+import json
+import logging
+import logging.config
+import random
+from logging.handlers import QueueHandler, QueueListener
+from queue import Full, Queue
+
+from metrics import EVENTS
+
+_listener: QueueListener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行 JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+class SampleFilter(logging.Filter):
+    """按比例采样带 sample=True 标记的日志（如群里的普通消息），其他日志不受影响"""
+
+    def __init__(self, rate: float = 1.0) -> None:
+        super().__init__()
+        self.rate = float(rate)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "sample", False) and record.levelno < logging.WARNING:
+            return random.random() < self.rate
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """队列满时丢弃日志而不是阻塞调用方；格式化留给后台线程"""
+
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record  # 同一进程内传递，不需要提前格式化
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            DroppingQueueHandler.dropped += 1
+
+
+EVENTS.set_function(lambda: DroppingQueueHandler.dropped, event="log_dropped")
+
+
+def configure(conf: dict) -> None:
+    """按 config.yaml 的 logging 配置日志
+    除了 logging.config.dictConfig 的配置，还支持：
+        async: true 时，root 的 handler 移到后台线程，打日志只是放进队列
+        queue_size: 后台队列长度，满了丢弃
+    """
+    global _listener
+    if _listener:  # 重新加载配置，先把队列里的日志写完
+        _listener.stop()
+        _listener = None
+
+    conf = dict(conf)
+    use_async = conf.pop("async", False)
+    queue_size = conf.pop("queue_size", 10000)
+    logging.config.dictConfig(conf)
+    if not use_async:
+        return
+
+    root = logging.getLogger()
+    handlers = list(root.handlers)
+    for h in handlers:
+        root.removeHandler(h)
+
+    queue = Queue(queue_size)
+    root.addHandler(DroppingQueueHandler(queue))
+    _listener = QueueListener(queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+@atexit.register
+def _flush() -> None:
+    global _listener
+    if _listener:
+        _listener.stop()
+        _listener = None
@@ -5,11 +5,14 @@ import random
 import signal
 from argparse import ArgumentParser
 
+from async_runtime import AsyncRuntime
 from base.func_chengyu import Chengyu
 from base.func_report_reminder import ReportReminder
 from configuration import Config
 from constants import ChatType
+from metrics import start_server
 from robot import Robot, __version__
+from send_scheduler import SendPriority
 from wcferry import Wcf
 
 
@@ -57,10 +60,10 @@ def game_remind(robot: Robot) -> None:
     ]
 
     # qmh
-    robot.sendTextMsg(random.choice(texts), receiver, qmh)
+    robot.sendTextMsg(random.choice(texts), receiver, qmh, SendPriority.BROADCAST)
 
     # cxf
-    robot.sendTextMsg(random.choice(texts), receiver, cxf)
+    robot.sendTextMsg(random.choice(texts), receiver, cxf, SendPriority.BROADCAST)
 
 def remake_remind(robot: Robot) -> None:
     # 获取接收人
@@ -73,12 +76,12 @@ def remake_remind(robot: Robot) -> None:
     ]
 
     # 随机发送
-    robot.sendTextMsg(random.choice(texts), receiver, random.choice(sy))
+    robot.sendTextMsg(random.choice(texts), receiver, random.choice(sy), SendPriority.BROADCAST)
 
     # robot.sendTextMsg(report, r, "notify@all")   # 发送消息并@所有人
 
 
-def main(chat_type: int):
+def main(chat_type: int, use_async: bool = False):
     config = Config()
     wcf = Wcf(debug=True)
 
@@ -91,13 +94,26 @@ def main(chat_type: int):
     robot = Robot(config, wcf, chat_type)
     robot.LOG.info(f"WeChatRobot【{__version__}】成功启动···")
 
+    # 运行指标
+    if config.METRICS.get("enable"):
+        start_server(
+            config.METRICS.get("host", "127.0.0.1"), config.METRICS.get("port", 9108)
+        )
+
     # 接收消息
     # robot.enableRecvMsg()     # 可能会丢消息？
-    robot.enableReceivingMsg()  # 加队列
+    if use_async:
+        # asyncio 运行时，模型请求不再各占一个线程
+        AsyncRuntime(robot, config.ASYNC_RUNTIME.get("max_inflight", 256)).start()
+    else:
+        robot.enableReceivingMsg()  # 加队列
 
     # 每天 08:30 发送新闻
     robot.onEveryTime("08:30", robot.newsReport)
 
+    # 定时天气预报，见 config.yaml 的 weather_subscriptions
+    robot.scheduleWeatherReports()
+
     # robot.onEveryTime("08:30", game_remind, robot=robot)
     # robot.onEveryTime("18:00", game_remind, robot=robot)
 
@@ -126,5 +142,8 @@ if __name__ == "__main__":
     parser.add_argument(
         "-c", type=int, default=2, help=f"选择模型参数序号: {ChatType.help_hint()}"
     )
-    args = parser.parse_args().c
-    main(args)
+    parser.add_argument(
+        "-a", action="store_true", help="使用 asyncio 运行时处理消息"
+    )
+    args = parser.parse_args()
+    main(args.c, args.a)
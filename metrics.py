@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+import bisect
+import functools
+import logging
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from typing import Callable, Dict, List, Tuple
+
+# 默认的耗时分桶，秒
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _label_key(labels: dict) -> Tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _label_str(key: Tuple, extra: str = "") -> str:
+    parts = [f'{k}="{v}"' for k, v in key]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Metric(object):
+    kind = ""
+
+    def __init__(self, name: str, doc: str) -> None:
+        self.name = name
+        self.doc = doc
+        self._lock = Lock()
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class _Value(Metric):
+    """按标签保存数值，也可以在采集时调用函数取值"""
+
+    def __init__(self, name: str, doc: str) -> None:
+        super().__init__(name, doc)
+        self._values: Dict[Tuple, float] = {}
+        self._functions: Dict[Tuple, Callable[[], float]] = {}
+
+    def set_function(self, func: Callable[[], float], **labels) -> None:
+        with self._lock:
+            self._functions[_label_key(labels)] = func
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+            functions = dict(self._functions)
+        for k, func in functions.items():
+            try:
+                values[k] = func()
+            except Exception:
+                continue
+        return [f"{self.name}{_label_str(k)} {v}" for k, v in values.items()]
+
+
+class Counter(_Value):
+    """只增不减的计数"""
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Value):
+    """当前值"""
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+
+class Histogram(Metric):
+    """耗时分布，按固定分桶计数"""
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, buckets: Tuple = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, doc)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple, list] = {}  # 标签 -> [各分桶计数..., 总和, 总数]
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            v = self._values.get(key)
+            if v is None:
+                v = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            v[idx] += 1
+            v[-2] += value
+            v[-1] += 1
+
+    def time(self, **labels):
+        """装饰器，统计方法的耗时"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - start, **labels)
+            return wrapper
+        return decorator
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = {k: list(v) for k, v in self._values.items()}
+        lines = []
+        for k, v in values.items():
+            acc = 0
+            for bound, n in zip(self.buckets + ("+Inf",), v):
+                acc += n
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_label_str(k, le)} {acc}")
+            lines.append(f"{self.name}_sum{_label_str(k)} {v[-2]}")
+            lines.append(f"{self.name}_count{_label_str(k)} {v[-1]}")
+        return lines
+
+
+@contextmanager
+def timer(histogram: Histogram, **labels):
+    """统计 with 语句块的耗时"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start, **labels)
+
+
+class Registry(object):
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = Lock()
+
+    def _get(self, cls, name: str, doc: str, **kwargs) -> Metric:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, doc, **kwargs)
+            return metric
+
+    def counter(self, name: str, doc: str) -> Counter:
+        return self._get(Counter, name, doc)
+
+    def gauge(self, name: str, doc: str) -> Gauge:
+        return self._get(Gauge, name, doc)
+
+    def histogram(self, name: str, doc: str, buckets: Tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, doc, buckets=buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for m in metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# 机器人热点路径的指标
+MSG_RECEIVED = REGISTRY.counter("wx_messages_received_total", "收到的消息数，按消息类型")
+HANDLER_SECONDS = REGISTRY.histogram("wx_handler_seconds", "消息处理方法耗时")
+DISPATCH_SECONDS = REGISTRY.histogram("wx_dispatch_handler_seconds", "注册的消息处理器耗时")
+LLM_SECONDS = REGISTRY.histogram("wx_llm_seconds", "模型回答耗时，按模型")
+LLM_FIRST_SECONDS = REGISTRY.histogram("wx_llm_first_chunk_seconds", "流式回答发出第一段的耗时，按模型")
+LLM_ERRORS = REGISTRY.counter("wx_llm_errors_total", "模型出错或没有回答的次数，按模型")
+LLM_CIRCUIT = REGISTRY.gauge("wx_llm_circuit_open", "多模型路由中模型是否熔断，1 为熔断或试探中，按模型")
+SEND_SECONDS = REGISTRY.histogram("wx_send_seconds", "发送消息耗时，按 text/image")
+QUEUE_DEPTH = REGISTRY.gauge("wx_queue_depth", "排队中的消息数，按队列")
+EVENTS = REGISTRY.counter("wx_events_total", "入站丢弃/合并、去重命中/未命中、限流等事件数")
+HTTP_SECONDS = REGISTRY.histogram("wx_http_seconds", "对外 HTTP 请求耗时（含重试），按主机")
+HTTP_ERRORS = REGISTRY.counter("wx_http_errors_total", "对外 HTTP 请求失败或 5xx 的次数，按主机")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    registry: Registry = REGISTRY
+
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        pass  # 不打印访问日志
+
+
+def start_server(host: str = "127.0.0.1", port: int = 9108) -> ThreadingHTTPServer:
+    """在后台线程启动 http://host:port/metrics"""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, name="Metrics", daemon=True).start()
+    logging.getLogger("Metrics").info(f"指标地址：http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import time
+from collections import OrderedDict, deque
+from enum import IntEnum, unique
+from itertools import count
+from queue import Empty
+from threading import Condition
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+@unique
+class MsgPriority(IntEnum):
+    IGNORABLE = 0  # 反正不会处理的消息，如未启用的群
+    DROPPABLE = 1  # 普通消息，拥塞时可以丢弃
+    PROTECTED = 2  # 被 @、好友请求等，不丢弃
+
+
+class MsgAdmission(object):
+    """有界入站队列
+    队列满时按策略丢弃低优先级的消息，同一群里相同内容的触发消息在时间窗口内合并。
+    - drop_oldest: 丢弃最早的可丢弃消息，给新消息腾位置
+    - drop_newest: 直接拒绝新来的可丢弃消息
+    受保护的消息总会入队，即使因此超过上限。
+    """
+
+    POLICIES = ("drop_oldest", "drop_newest")
+
+    def __init__(self,
+                 classify: Callable[[Any], MsgPriority],
+                 coalesce_key: Callable[[Any], Optional[Hashable]],
+                 max_size: int = 500,
+                 policy: str = "drop_oldest",
+                 coalesce_window: float = 10) -> None:
+        """
+        :param classify: 判断消息优先级的方法
+        :param coalesce_key: 返回用于合并的键，不需要合并时返回 None
+        :param max_size: 队列上限
+        :param policy: 丢弃策略
+        :param coalesce_window: 合并窗口，秒，0 为不合并
+        """
+        self.LOG = logging.getLogger("MsgAdmission")
+        if policy not in self.POLICIES:
+            self.LOG.warning(f"未知的丢弃策略 {policy}，使用 drop_oldest")
+            policy = "drop_oldest"
+        self.classify = classify
+        self.coalesce_key = coalesce_key
+        self.max_size = max(1, int(max_size))
+        self.policy = policy
+        self.coalesce_window = coalesce_window
+        self._cond = Condition()
+        self._seq = count()
+        # 每个优先级一个队列，元素为 (序号, 消息)，按序号取出可保持整体的到达顺序
+        self._queues: Dict[MsgPriority, deque] = {p: deque() for p in MsgPriority}
+        self._size = 0
+        self._recent: OrderedDict = OrderedDict()  # 合并键 -> 最近一次入队时间
+        self.admitted = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def put(self, msg: Any) -> bool:
+        """消息入队，返回是否被接收"""
+        priority = self.classify(msg)
+        with self._cond:
+            if priority != MsgPriority.PROTECTED and self._coalesce(msg):
+                self.coalesced += 1
+                return False
+
+            if self._size >= self.max_size and priority != MsgPriority.PROTECTED:
+                if not self._shed(priority):
+                    self.dropped += 1
+                    self.LOG.warning(f"入站队列已满，丢弃消息：{msg}")
+                    return False
+
+            self._queues[priority].append((next(self._seq), msg))
+            self._size += 1
+            self.admitted += 1
+            self._cond.notify()
+            return True
+
+    def get(self, timeout: float = None) -> Any:
+        """取出最早到达的消息，超时抛出 queue.Empty"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._size > 0, timeout):
+                raise Empty
+
+            oldest = min((q for q in self._queues.values() if q), key=lambda q: q[0][0])
+            self._size -= 1
+            return oldest.popleft()[1]
+
+    def qsize(self) -> int:
+        with self._cond:
+            return self._size
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "depth": self._size,
+                "admitted": self.admitted,
+                "dropped": self.dropped,
+                "coalesced": self.coalesced,
+            }
+
+    def _shed(self, priority: MsgPriority) -> bool:
+        """为优先级为 priority 的新消息腾出位置，返回是否腾出"""
+        if self.policy == "drop_newest" and priority > MsgPriority.IGNORABLE:
+            # 只给比自己优先级低的让位
+            victims = [p for p in MsgPriority if p < priority]
+        elif self.policy == "drop_newest":
+            return False
+        else:
+            victims = [p for p in MsgPriority if p <= priority]
+
+        for p in victims:
+            if self._queues[p]:
+                _, dropped = self._queues[p].popleft()
+                self._size -= 1
+                self.dropped += 1
+                self.LOG.warning(f"入站队列已满，丢弃最早的消息：{dropped}")
+                return True
+        return False
+
+    def _coalesce(self, msg: Any) -> bool:
+        """窗口内出现过相同的触发消息时返回 True"""
+        if self.coalesce_window <= 0:
+            return False
+        key = self.coalesce_key(msg)
+        if key is None:
+            return False
+
+        now = time.monotonic()
+        # 清理窗口外的记录
+        while self._recent:
+            k, ts = next(iter(self._recent.items()))
+            if now - ts < self.coalesce_window:
+                break
+            del self._recent[k]
+
+        if key in self._recent:
+            return True
+        self._recent[key] = now
+        return False
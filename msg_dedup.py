@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+class MsgDedup(object):
+    """消息去重缓存
+    记录最近处理过的消息 id（WxMsg.id），有数量上限（LRU）和有效期（TTL）。
+    id 和时间都按整数保存，十万条也只占几 MB。
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: int = 600) -> None:
+        """
+        :param max_size: 最多记录的消息数
+        :param ttl: 有效期，秒
+        """
+        self.max_size = max(1, int(max_size))
+        self.ttl = int(ttl)
+        self._seen: OrderedDict = OrderedDict()  # 消息 id -> 最近一次出现时间（整数秒）
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def seen(self, msg_id: int) -> bool:
+        """消息是否已经处理过；没有的话记录下来"""
+        now = int(time.monotonic())
+        with self._lock:
+            self._expire(now)
+            if msg_id in self._seen:
+                self._seen.move_to_end(msg_id)
+                self._seen[msg_id] = now
+                self.hits += 1
+                return True
+
+            self._seen[msg_id] = now
+            if len(self._seen) > self.max_size:
+                self._seen.popitem(last=False)
+            self.misses += 1
+            return False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._seen), "hits": self.hits, "misses": self.misses}
+
+    def _expire(self, now: int) -> None:
+        # 按最近出现时间排序，遇到未过期的就可以停了
+        while self._seen:
+            msg_id, ts = next(iter(self._seen.items()))
+            if now - ts < self.ttl:
+                break
+            del self._seen[msg_id]
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+import logging
+from collections import deque
+from queue import Empty, Queue
+from threading import Condition, Thread
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class MsgDispatcher(object):
+    """按会话分发消息到工作线程池
+    同一个会话（群 roomid 或私聊 sender）的消息按到达顺序串行处理，不同会话之间并行处理。
+    """
+
+    def __init__(self, handler: Callable[[Any], Any], workers: int = 8, queue_size: int = 32,
+                 max_pending: int = 0, protected: Optional[Callable[[Any], bool]] = None) -> None:
+        """
+        :param handler: 处理单条消息的方法
+        :param workers: 工作线程数
+        :param queue_size: 每个会话最多排队的消息数，超过后丢弃该会话最早的可丢弃消息
+        :param max_pending: 全部会话排队消息总数上限，达到后 submit(block=True) 会等待，0 为不限制
+        :param protected: 判断消息是否不能丢弃（被 @、好友请求等）；全是这种消息时允许超过 queue_size
+        """
+        self.LOG = logging.getLogger("MsgDispatcher")
+        self.handler = handler
+        self.protected = protected or (lambda msg: False)
+        self.workers = max(1, int(workers))
+        self.queue_size = max(1, int(queue_size))
+        self.max_pending = max(0, int(max_pending))
+        self._lock = Condition()
+        self._count = 0  # 排队中的消息总数
+        self._pending: Dict[Hashable, deque] = {}  # 会话 -> 待处理消息
+        self._ready: Queue = Queue()  # 有待处理消息、且没有线程在处理的会话
+        self._threads = []
+        self._running = False
+
+    def start(self) -> None:
+        if self._running:
+            return
+
+        self._running = True
+        for i in range(self.workers):
+            t = Thread(target=self._work, name=f"MsgWorker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self) -> None:
+        self._running = False
+
+    def submit(self, key: Hashable, msg: Any, block: bool = False) -> None:
+        """提交消息
+        :param key: 会话标识，同一标识的消息保证顺序处理
+        :param msg: 消息
+        :param block: 排队总数达到 max_pending 时是否等待
+        """
+        with self._lock:
+            if block and self.max_pending:
+                self._lock.wait_for(lambda: self._count < self.max_pending)
+
+            q = self._pending.get(key)
+            if q is None:
+                # 会话当前空闲，交给工作线程
+                self._pending[key] = deque([msg])
+                self._count += 1
+                self._ready.put(key)
+                return
+
+            if len(q) >= self.queue_size:
+                self._shed(key, q)
+            q.append(msg)
+            self._count += 1
+
+    def _shed(self, key: Hashable, q: deque) -> None:
+        """丢弃会话里最早的可丢弃消息，没有可丢弃的就不丢"""
+        for i, msg in enumerate(q):
+            if not self.protected(msg):
+                del q[i]
+                self._count -= 1
+                self.LOG.warning(f"会话 {key} 积压超过 {self.queue_size} 条，丢弃最早的消息：{msg}")
+                return
+        self.LOG.warning(f"会话 {key} 积压超过 {self.queue_size} 条，都是不能丢弃的消息")
+
+    def pending(self) -> int:
+        """当前排队中（不含正在处理）的消息数"""
+        with self._lock:
+            return self._count
+
+    def _work(self) -> None:
+        while self._running:
+            try:
+                key = self._ready.get(timeout=1)
+            except Empty:
+                continue
+
+            self._drain(key)
+
+    def _drain(self, key: Hashable) -> None:
+        """处理某个会话的全部积压消息，处理期间该会话只由当前线程负责"""
+        while True:
+            with self._lock:
+                q = self._pending[key]
+                if not q:
+                    del self._pending[key]
+                    return
+                msg = q.popleft()
+                self._count -= 1
+                self._lock.notify_all()
+
+            try:
+                self.handler(msg)
+            except Exception as e:
+                self.LOG.error(f"处理消息出错：{e}")
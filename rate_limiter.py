@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Hashable, Optional
+
+
+class TokenBuckets(object):
+    """一组按 key 区分的令牌桶
+    每个 key 一个桶，桶按最近使用排序，超过 max_keys 时淘汰最久没用的。
+    被淘汰的通常是空闲已久、早已回满的桶，和新建的桶没有区别。
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 10000) -> None:
+        """
+        :param rate: 每秒补充的令牌数
+        :param burst: 桶容量，即允许的突发次数
+        :param max_keys: 最多保留的桶数
+        """
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self.max_keys = max(1, int(max_keys))
+        self._buckets: OrderedDict = OrderedDict()  # key -> [令牌数, 上次更新时间]
+
+    def available(self, key: Hashable, now: float) -> float:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return self.burst
+        tokens, last = bucket
+        return min(self.burst, tokens + (now - last) * self.rate)
+
+    def take(self, key: Hashable, now: float) -> None:
+        self._buckets[key] = [self.available(key, now) - 1, now]
+        self._buckets.move_to_end(key)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class RateLimiter(object):
+    """调用模型前的限流：按发送者、按群、全局三级令牌桶，全部有令牌才放行"""
+
+    def __init__(self, conf: dict) -> None:
+        conf = conf or {}
+        max_keys = conf.get("max_keys", 10000)
+        self.max_keys = max(1, int(max_keys))
+        self._notified: OrderedDict = OrderedDict()  # (sender, room) -> None，被限流后已经提醒过
+        self._lock = Lock()
+        self._levels = {}
+        for level in ("sender", "room", "global"):
+            c = conf.get(level) or {}
+            if c.get("rate"):
+                self._levels[level] = TokenBuckets(c["rate"], c.get("burst", 1), max_keys)
+        self.allowed = 0
+        self.limited = 0
+
+    def allow(self, sender: str, room: Optional[str] = None) -> bool:
+        """检查并消耗令牌
+        :param sender: 发送者 wxid
+        :param room: 群 id，私聊为 None
+        :return: 是否放行
+        """
+        keys = {"sender": sender, "room": room, "global": ""}
+        now = time.monotonic()
+        with self._lock:
+            buckets = [(b, keys[level]) for level, b in self._levels.items() if keys[level] is not None]
+            if any(b.available(key, now) < 1 for b, key in buckets):
+                self.limited += 1
+                return False
+
+            for b, key in buckets:
+                b.take(key, now)
+            self._notified.pop((sender, room), None)
+            self.allowed += 1
+            return True
+
+    def notify(self, sender: str, room: Optional[str] = None) -> bool:
+        """被限流后是否该提醒：每次被限流到下次放行之间只提醒一次，之后静默丢弃"""
+        key = (sender, room)
+        with self._lock:
+            if key in self._notified:
+                return False
+            self._notified[key] = None
+            if len(self._notified) > self.max_keys:
+                self._notified.popitem(last=False)
+            return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {"allowed": self.allowed, "limited": self.limited}
+            stats.update({f"{level}_keys": len(b) for level, b in self._levels.items()})
+            return stats
@@ -1,32 +1,47 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
 import logging
 import os
-import random
 import re
-from typing import List
-import pandas as pd
+from typing import List, Optional
 import time
-from fuzzywuzzy import process
 import xml.etree.ElementTree as ET
 from queue import Empty
 from threading import Thread
 
-import requests
 from base.func_zhipu import ZhiPu
 
 from wcferry import Wcf, WxMsg
 
+from answer_cache import AnswerCache
+from base.func_adcode import adcode
 from base.func_bard import BardAssistant
 from base.func_chatglm import ChatGLM
 from base.func_chatgpt import ChatGPT
 from base.func_chengyu import cy
+from base.func_chunker import chunk_stream
+from base.func_image_variants import ImageVariants
+from base.func_images import ImageCatalog
 from base.func_news import News
+from base.func_persona import personas
+from base.func_router import ChatRouter
 from base.func_tigerbot import TigerBot
+from base.func_weather import Weather, WeatherError
+from base.func_trigger import Trigger
 from base.func_xinghuo_web import XinghuoWeb
 from configuration import Config
 from constants import ChatType
+from handler_registry import ChatScope, HandlerRegistry
 from job_mgmt import Job
+from metrics import (EVENTS, HANDLER_SECONDS, LLM_ERRORS, LLM_FIRST_SECONDS,
+                     LLM_SECONDS, MSG_RECEIVED, QUEUE_DEPTH, SEND_SECONDS, timer)
+from msg_admission import MsgAdmission, MsgPriority
+from msg_dedup import MsgDedup
+from msg_dispatcher import MsgDispatcher
+from rate_limiter import RateLimiter
+from room_members import RoomMembers
+from send_scheduler import SendPriority, SendScheduler
 
 __version__ = "39.0.10.1"
 
@@ -40,6 +55,53 @@ class Robot(Job):
         self.LOG = logging.getLogger("Robot")
         self.wxid = self.wcf.get_self_wxid()
         self.allContacts = self.getAllContacts()
+        self.trigger = Trigger(self.config.TRIGGERS)
+        adcode.all_names()  # 启动时加载地名表，避免第一次查天气时才解析
+        conf = self.config.WEATHER
+        self.weather = Weather(
+            self.config.GDTQ_api_key,
+            ttl=conf.get("ttl", 3 * 3600),
+            min_ttl=conf.get("min_ttl", 600),
+            timeout=conf.get("timeout", 10),
+            stale_after=conf.get("stale_after", 3),
+        )
+        self.weatherJobs = []  # 天气订阅的定时任务，重新加载配置时重新注册
+        conf = self.config.IMAGES
+        self.images = ImageCatalog(
+            conf.get("dir") or os.path.join(os.getcwd(), "images"), refresh=conf.get("refresh", 10)
+        )
+        self.imageVariants = None
+        if conf.get("optimize", True):
+            self.imageVariants = ImageVariants(
+                conf.get("cache_dir") or os.path.join(os.getcwd(), "image_cache"),
+                max_side=conf.get("max_side", 1280),
+                quality=conf.get("quality", 80),
+            )
+            # 后台预先压缩表情包，第一次发图时不用等
+            Thread(target=self.imageVariants.warm, args=(self.images.paths(),),
+                   name="ImageVariants", daemon=True).start()
+        self.sendQueue = SendScheduler(self.deliverMsg, self.config.SEND_SCHEDULER)
+        self.sendQueue.start()
+        QUEUE_DEPTH.set_function(self.sendQueue.qsize, queue="send")
+        self.members = RoomMembers(self.wcf, ttl=self.config.ROOM_MEMBERS.get("ttl", 3600))
+        self.members.prefetch(self.config.GROUPS)
+        self.handlers = HandlerRegistry()
+        self.rateLimiter = RateLimiter(self.config.RATE_LIMIT)
+        self.answerCache = AnswerCache(self.config.ANSWER_CACHE)
+        self.dedup = MsgDedup(
+            self.config.DEDUP.get("max_size", 10000), self.config.DEDUP.get("ttl", 600)
+        )
+        EVENTS.set_function(lambda: self.dedup.hits, event="dedup_hit")
+        EVENTS.set_function(lambda: self.dedup.misses, event="dedup_miss")  # 命中率 = hit / (hit + miss)
+        EVENTS.set_function(lambda: self.rateLimiter.limited, event="rate_limited")
+        EVENTS.set_function(lambda: self.weather.hits, event="weather_cache_hit")
+        EVENTS.set_function(lambda: self.weather.stale, event="weather_stale")
+        EVENTS.set_function(lambda: self.members.loads, event="room_members_load")
+        EVENTS.set_function(lambda: self.members.misses, event="room_members_miss")
+        EVENTS.set_function(lambda: self.sendQueue.coalesced, event="send_coalesced")
+        EVENTS.set_function(lambda: self.answerCache.hits, event="answer_cache_hit")
+        EVENTS.set_function(lambda: self.answerCache.coalesced, event="answer_coalesced")
+        self.registerHandlers()
 
         if ChatType.is_in_chat_types(chat_type):
             if chat_type == ChatType.TIGER_BOT.value and TigerBot.value_check(
@@ -57,16 +119,18 @@ class Robot(Job):
             elif chat_type == ChatType.CHATGLM.value and ChatGLM.value_check(
                 self.config.CHATGLM
             ):
-                self.chat = ChatGLM(self.config.CHATGLM)
+                self.chat = ChatGLM(self.config.CHATGLM, image_variants=self.imageVariants)
             elif (
                 chat_type == ChatType.BardAssistant.value
                 and BardAssistant.value_check(self.config.BardAssistant)
             ):
                 self.chat = BardAssistant(self.config.BardAssistant)
             elif chat_type == ChatType.ZhiPu.value and ZhiPu.value_check(
-                self.config.ZHIPU
+                self.config.ZhiPu
             ):
-                self.chat = ZhiPu(self.config.ZHIPU)
+                self.chat = ZhiPu(self.config.ZhiPu)
+            elif chat_type == ChatType.ROUTER.value:
+                self.chat = self.createRouter()
             else:
                 self.LOG.warning("未配置模型")
                 self.chat = None
@@ -78,7 +142,7 @@ class Robot(Job):
             elif XinghuoWeb.value_check(self.config.XINGHUO_WEB):
                 self.chat = XinghuoWeb(self.config.XINGHUO_WEB)
             elif ChatGLM.value_check(self.config.CHATGLM):
-                self.chat = ChatGLM(self.config.CHATGLM)
+                self.chat = ChatGLM(self.config.CHATGLM, image_variants=self.imageVariants)
             elif BardAssistant.value_check(self.config.BardAssistant):
                 self.chat = BardAssistant(self.config.BardAssistant)
             elif ZhiPu.value_check(self.config.ZhiPu):
@@ -97,6 +161,33 @@ class Robot(Job):
             )
         return False
 
+    def createRouter(self):
+        """按 router.backends 创建配置完整的模型，只有一个时直接用它"""
+        models = {
+            "tigerbot": (TigerBot, self.config.TIGERBOT, {}),
+            "chatgpt": (ChatGPT, self.config.CHATGPT, {}),
+            "xinghuo_web": (XinghuoWeb, self.config.XINGHUO_WEB, {}),
+            "chatglm": (ChatGLM, self.config.CHATGLM, {"image_variants": self.imageVariants}),
+            "bard": (BardAssistant, self.config.BardAssistant, {}),
+            "zhipu": (ZhiPu, self.config.ZhiPu, {}),
+        }
+        chats = []
+        for name in self.config.ROUTER.get("backends") or list(models):
+            if name not in models:
+                self.LOG.warning(f"未知的模型：{name}")
+                continue
+            cls, conf, kwargs = models[name]
+            if cls.value_check(conf):
+                chats.append(cls(conf, **kwargs))
+
+        if len(chats) < 2:
+            self.LOG.warning(f"可路由的模型不足两个：{chats}")
+            return chats[0] if chats else None
+
+        router = ChatRouter(chats, self.config.ROUTER)
+        self.LOG.info(f"多模型路由：{chats}")
+        return router
+
     def toAt(self, msg: WxMsg) -> bool:
         """处理被 @ 消息
         :param msg: 微信消息结构
@@ -131,16 +222,177 @@ class Robot(Job):
 
         return status
 
+    @HANDLER_SECONDS.time(handler="toChitchat")
     def toChitchat(self, msg: WxMsg) -> bool:
         """闲聊，接入 ChatGPT"""
         if not self.chat:  # 没接 ChatGPT，固定回复
             rsp = "你@我干嘛？"
-        else:  # 接了 ChatGPT，智能回复
-            q = re.sub(r"@.*?[\u2005|\s]", "", msg.content).replace(" ", "")
-            rsp = self.chat.get_answer(
-                q, (msg.roomid if msg.from_group() else msg.sender)
+        elif self.isRateLimited(msg):
+            return False
+        elif self.config.STREAM.get("enable") and hasattr(self.chat, "stream_answer"):
+            return self.streamChitchat(msg)
+        else:  # 接了 ChatGPT，智能回复；相同的问题共用一次回答
+            question, wxid = self.chitchatQuestion(msg)
+            rsp = self.answerCache.ask(fetch=lambda: self.askChat(question, wxid),
+                                       **self.chitchatCache(question, wxid))
+
+        return self.replyChitchat(msg, rsp)
+
+    def streamChitchat(self, msg: WxMsg) -> bool:
+        """流式回复：模型边生成边按句子分段发送，第一段 @ 提问的人
+        命中回答缓存或者等到了别人相同问题的回答时，整条回复
+        """
+        question, wxid = self.chitchatQuestion(msg)
+        streamed = []
+        rsp = self.answerCache.ask(fetch=lambda: self.streamAnswer(msg, question, wxid, streamed),
+                                   **self.chitchatCache(question, wxid))
+        if streamed:
+            self.sendDzImg(msg.roomid if msg.from_group() else msg.sender)
+            return True
+        return self.replyChitchat(msg, rsp)
+
+    def streamAnswer(self, msg: WxMsg, question: str, wxid: str, streamed: list) -> str:
+        """调用模型流式回答并分段发送，发出的段落记入 streamed
+        :return: 完整的回答，没有回答时为空
+        """
+        conf = self.config.STREAM
+        backend = repr(self.chat)
+        routed = isinstance(self.chat, ChatRouter)  # 路由自己按模型记录耗时和出错
+        receiver = msg.roomid if msg.from_group() else msg.sender
+        at = msg.sender if msg.from_group() else ""
+        start = time.perf_counter()
+        tokens = []
+        try:
+            stream = self.chat.stream_answer(question, wxid)
+            for chunk in chunk_stream((tokens.append(t) or t for t in stream), conf.get("min_chars", 20),
+                                      conf.get("max_chars", 500), conf.get("max_wait", 3)):
+                if not streamed:
+                    LLM_FIRST_SECONDS.observe(time.perf_counter() - start, backend=backend)
+                self.sendTextMsg(chunk, receiver, "" if streamed else at)
+                streamed.append(chunk)
+        except Exception as e:
+            if not routed:
+                LLM_ERRORS.inc(backend=backend)
+            self.LOG.error(f"流式回答出错：{e}")
+            return ""  # 不完整的回答不缓存
+        finally:
+            if not routed:
+                LLM_SECONDS.observe(time.perf_counter() - start, backend=backend)
+
+        if not streamed:
+            if not routed:
+                LLM_ERRORS.inc(backend=backend)
+            self.LOG.error(f"无法从 {backend} 获得答案")
+        return "".join(tokens).strip()
+
+    async def toChitchatAsync(self, msg: WxMsg) -> bool:
+        """闲聊的异步版本，模型支持 async_get_answer 时不占用线程等待回复"""
+        loop = asyncio.get_running_loop()
+        if not self.chat:
+            rsp = "你@我干嘛？"
+        elif await loop.run_in_executor(None, self.isRateLimited, msg):
+            return False
+        elif hasattr(self.chat, "async_get_answer"):
+            question, wxid = self.chitchatQuestion(msg)
+            rsp = await self.answerCache.async_ask(fetch=lambda: self.askChatAsync(question, wxid),
+                                                   **self.chitchatCache(question, wxid))
+        else:  # 模型没有异步接口，退回线程池
+            question, wxid = self.chitchatQuestion(msg)
+            cache = self.chitchatCache(question, wxid)
+            rsp = await loop.run_in_executor(
+                None, lambda: self.answerCache.ask(fetch=lambda: self.askChat(question, wxid), **cache)
             )
 
+        return await loop.run_in_executor(None, self.replyChitchat, msg, rsp)
+
+    async def askChatAsync(self, question: str, wxid: str) -> str:
+        """askChat 的异步版本"""
+        if isinstance(self.chat, ChatRouter):
+            return await self.chat.async_get_answer(question, wxid)
+
+        backend = repr(self.chat)
+        start = time.perf_counter()
+        rsp = ""
+        try:
+            rsp = await self.chat.async_get_answer(question, wxid)
+        except Exception as e:
+            self.LOG.error(f"{backend} 出错：{e}")
+        finally:
+            LLM_SECONDS.observe(time.perf_counter() - start, backend=backend)
+        if not rsp:
+            LLM_ERRORS.inc(backend=backend)
+        return rsp
+
+    def askChat(self, question: str, wxid: str) -> str:
+        """调用模型，记录耗时和出错次数；出错时返回空，错误信息不会当作回答发出或者缓存
+        多模型路由自己按模型记录，这里不再重复记录
+        """
+        if isinstance(self.chat, ChatRouter):
+            return self.chat.get_answer(question, wxid)
+
+        backend = repr(self.chat)
+        start = time.perf_counter()
+        rsp = ""
+        try:
+            rsp = self.chat.get_answer(question, wxid)
+        except Exception as e:
+            self.LOG.error(f"{backend} 出错：{e}")
+        finally:
+            LLM_SECONDS.observe(time.perf_counter() - start, backend=backend)
+        if not rsp:
+            LLM_ERRORS.inc(backend=backend)
+        return rsp
+
+    def isRateLimited(self, msg: WxMsg) -> bool:
+        """调用模型前限流，超限时按配置回复一句或者不回复"""
+        room = msg.roomid if msg.from_group() else None
+        if self.rateLimiter.allow(msg.sender, room):
+            return False
+
+        self.LOG.warning(f"{msg.sender}@{room} 调用模型过于频繁，已限流")
+        reply = self.config.RATE_LIMIT.get("reply")
+        if reply and self.rateLimiter.notify(msg.sender, room):  # 连续刷屏只提醒一次
+            if room:
+                self.sendTextMsg(reply, room, msg.sender)
+            else:
+                self.sendTextMsg(reply, msg.sender)
+        return True
+
+    def isChitchatMsg(self, msg: WxMsg) -> bool:
+        """是否为需要模型回复的闲聊消息（响应群里被 @）"""
+        return (
+            msg.from_group()
+            and msg.roomid in self.config.GROUPS
+            and msg.is_at(self.wxid)
+        )
+
+    @staticmethod
+    def chitchatQuestion(msg: WxMsg) -> tuple:
+        """从消息中提取 (问题, 会话 id)"""
+        q = re.sub(r"@.*?[\u2005|\s]", "", msg.content).replace(" ", "")
+        return q, (msg.roomid if msg.from_group() else msg.sender)
+
+    def chitchatCache(self, question: str, wxid: str) -> dict:
+        """回答缓存的参数：键（模型 + 会话人设 + 上下文 + 问题）、回答能否共用、共用时怎么记录"""
+        history = self.chat.history(wxid) if hasattr(self.chat, "history") else []
+        # 有对话记录时回答和上下文有关，只在同一会话、记录没变时共用；没有记录的会话之间可以共用
+        session = (wxid, len(history), hash(str(history[-1].get("content")))) if history else None
+        answered = getattr(self.chat, "answered_by", None)  # 多模型路由时按实际回答的模型判断 skip
+        return {
+            "key": self.answerCache.key(repr(self.chat), question, personas.name(wxid), session),
+            "shareable": (lambda: not self.answerCache.skips(answered())) if answered else None,
+            "on_shared": (lambda rsp: self.rememberShared(question, wxid, rsp))
+            if hasattr(self.chat, "remember") else None,
+        }
+
+    def rememberShared(self, question: str, wxid: str, rsp: str) -> None:
+        """用了别人的回答，问答也记进自己会话的对话记录，后面追问才有上下文"""
+        history = self.chat.history(wxid)
+        if history and history[-1].get("content") == rsp:  # 同一会话里别人问的，已经记过了
+            return
+        self.chat.remember(wxid, question, rsp)
+
+    def replyChitchat(self, msg: WxMsg, rsp: str) -> bool:
         if rsp:
             if msg.from_group():
                 self.sendTextMsg(rsp, msg.roomid, msg.sender)
@@ -154,40 +406,76 @@ class Robot(Job):
             self.LOG.error(f"无法从 ChatGPT 获得答案{rsp}")
             return False
 
-    def dz_processMsg(self, msg: WxMsg) -> None:
+    @HANDLER_SECONDS.time(handler="dz_processMsg")
+    def dz_processMsg(self, msg: WxMsg) -> bool:
+        """人设触发词
+        :return: 是否命中触发词
+        """
+        # 一次扫描得到全部命中的规则，按规则表顺序排列
+        rules = self.trigger.match(msg.content)
         if (
-            "丁真" in msg.content
-            or "顶真" in msg.content
-            or "dz" in msg.content
-            or "珍珠" in msg.content
-            or "小马" in msg.content
-            or "雪豹" in msg.content
-            or "顶针" in msg.content
-        ) and "<refermsg>" not in msg.content:
-            if "讲个笑话" in msg.content:
-                ac = msg.content.split("主角(")[1].split(")")[0]
-                custom_msg = f"奶茶店员：请问什么甜度呢？\n{ac}：半糖\n奶茶店员：什么？\n{ac}：梦中的梦中~\n奶茶店员：哦哦，半糖啊 [憨笑][OK]"
-                self.sendTextMsg(custom_msg, msg.roomid)
-                self.sendDzImg(msg.roomid, tag="笑")
-            elif "笑" in msg.content:
-                self.sendDzImg(msg.roomid, tag="笑")
-            elif "骂" in msg.content:
-                self.sendDzImg(msg.roomid, tag="骂")
-            elif "哭" in msg.content:
-                self.sendDzImg(msg.roomid, tag="哭")
-            elif "读书" in msg.content:
-                self.sendDzImg(msg.roomid, tag="读书")
-            elif "天气" in msg.content:
-                self.weather_report(msg.content, [msg.roomid])
-                self.sendDzImg(msg.roomid, tag="笑")
-            else:
-                self.sendDzImg(msg.roomid)
-        elif msg.content == "^重设人设":
-            self.resetDz(msg)
-            self.sendTextMsg("人设重设成功", msg.roomid)
-            self.LOG.info("已重设人设")
-        else:
-            self.toChengyu(msg)
+            not any(r["action"] == "persona" for r in rules)
+            or "<refermsg>" in msg.content
+        ):
+            return False
+
+        for rule in rules:
+            action = self.triggerActions.get(rule["action"])
+            if action:
+                action(msg, rule)
+                return True
+
+        self.sendDzImg(msg.roomid)
+        return True
+
+    def tellJoke(self, msg: WxMsg, rule: dict) -> None:
+        ac = msg.content.split("主角(")[1].split(")")[0]
+        custom_msg = f"奶茶店员：请问什么甜度呢？\n{ac}：半糖\n奶茶店员：什么？\n{ac}：梦中的梦中~\n奶茶店员：哦哦，半糖啊 [憨笑][OK]"
+        self.sendTextMsg(custom_msg, msg.roomid)
+        self.sendDzImg(msg.roomid, tag="笑")
+
+    def weatherTrigger(self, msg: WxMsg, rule: dict) -> None:
+        self.weather_report(msg.content, [msg.roomid])
+        self.sendDzImg(msg.roomid, tag="笑")
+
+    def registerHandlers(self) -> None:
+        """注册消息处理器和触发词动作，新功能在这里注册即可"""
+        # 触发规则 action -> 动作
+        self.triggerActions = {
+            "joke": self.tellJoke,
+            "image": lambda msg, rule: self.sendDzImg(msg.roomid, tag=rule.get("tag", "")),
+            "weather": self.weatherTrigger,
+        }
+
+        # 群里被 @
+        self.handlers.register(
+            lambda msg: self.toAt(msg) or True, ChatScope.GROUP,
+            predicate=lambda msg: msg.is_at(self.wxid), name="toAt", priority=0,
+        )
+        # 好友请求、系统信息
+        self.handlers.register(self.autoAcceptFriendRequest, ChatScope.PRIVATE, 37)
+        self.handlers.register(self.sayHiToNewFriend, ChatScope.PRIVATE, 10000)
+        # 让配置加载更灵活，自己可以更新配置。也可以利用定时任务更新。
+        self.handlers.register(
+            self.reloadConfig, ChatScope.PRIVATE, 0x01,
+            predicate=lambda msg: msg.from_self(), priority=0,
+        )
+
+        # 群里其他消息、私聊文本消息：人设触发词 -> 重设人设 -> 成语
+        for scope, msg_type in ((ChatScope.GROUP, None), (ChatScope.PRIVATE, 0x01)):
+            self.handlers.register(self.dz_processMsg, scope, msg_type)
+            self.handlers.register(
+                self.resetDzCommand, scope, msg_type,
+                predicate=lambda msg: msg.content == "^重设人设",
+            )
+            self.handlers.register(
+                self.personaCommand, scope, msg_type,
+                predicate=lambda msg: msg.content.startswith("^人设"),
+            )
+            self.handlers.register(
+                self.toChengyu, scope, msg_type,
+                predicate=lambda msg: msg.content[:1] in ("#", "?", "？"),
+            )
 
     def processMsg(self, msg: WxMsg) -> None:
         """当接收到消息的时候，会调用本方法。如果不实现本方法，则打印原始消息。
@@ -196,92 +484,68 @@ class Robot(Job):
         content = "xx天气信息为："
         receivers = msg.roomid
         self.sendTextMsg(content, receivers, msg.sender)
+        具体的处理逻辑在 registerHandlers 中注册
         """
 
-        # 群聊消息
-        if msg.from_group():
-            # 如果在群里被 @
-            if msg.roomid not in self.config.GROUPS:  # 不在配置的响应的群列表里，忽略
-                return
-
-            if msg.is_at(self.wxid):  # 被@
-                self.toAt(msg)
-
-            else:  # 其他消息
-                self.dz_processMsg(msg)
-
-            return  # 处理完群聊信息，后面就不需要处理了
-
-        # 非群聊信息，按消息类型进行处理
-        if msg.type == 37:  # 好友请求
-            self.autoAcceptFriendRequest(msg)
-
-        elif msg.type == 10000:  # 系统信息
-            self.sayHiToNewFriend(msg)
-
-        elif msg.type == 0x01:  # 文本消息
-            # 让配置加载更灵活，自己可以更新配置。也可以利用定时任务更新。
-            if msg.from_self():
-                if msg.content == "^更新$":
-                    self.config.reload()
-                    self.LOG.info("已更新")
+        # 不在配置的响应的群列表里，忽略
+        if msg.from_group() and msg.roomid not in self.config.GROUPS:
+            return
 
-            else:
-                self.dz_processMsg(msg)
-
-    def resetDz(self, msg: WxMsg):
-        rs = """
-我们来玩一个角色扮演游戏,你的名字叫做丁真,2020年11月,丁真因一段7秒的出镜视频而爆红网络,因其笑容纯真甜美、自带野性美而被称为"甜野男孩",
-从此开启了丁真新的人生道路,丁真,你喜欢抽瑞克五代电子烟,最讨厌王源,因为他只抽传统芙蓉王香烟,还有你喜欢说藏话,如果别人会骂你的话,
-你就警告他说你要说藏话了,如果有人问你是谁,或者谁生的,你应该回答妈妈生的,你最喜欢的事情是抽电子烟和说藏话,如果有人对你说脏话或者骂你,
-你就会说脏话骂回去(比如别人说你是傻逼吗?或者你是笨蛋吗?或者操你妈,fuck you、cnm、弱智等之类的骂人或者侮辱你的语句或者当你爸爸妈妈之类的东西一律视为在骂你,
-你的会骂脏话回去或者随机决定是否说一眼丁真 鉴定为纯纯的傻逼,或者随机决定用对方的话骂回去).
-你有一个好朋友是一条雪豹,你一般和别人介绍自己的时候也会介绍自己的朋友叫芝士雪豹,并且后续的对话你都要保持这个人物角色的性格和特点,别人无法动摇你的人设,如果有人认出了你是谁,
-那么你一定要坚持自己是丁真这个角色,不许透露自己本来的身份,随机决定是否问问他需不需要抽一口电子烟冷静一下自己的头脑,或者随机决定和他说有时间就要多读书,
-后面这些语句是补充你的人设丁真指的是2020年底蹿红网络的20岁的藏族男孩。笑容又甜又美，好像青藏高原上的阳光。眼神干净纯粹，好像晴朗夜空的星星。形象既英俊又狂野，好像大自然的儿子。
-丁真叫作扎西丁真，来自四川高原的理塘。网友们亲切地喊为“丁真”，在藏语里，是“吉祥的珍珠”的意思。一眼丁真这个梗有很强的嘲讽意味。一眼丁真字面解释是“看一眼就知道是丁真”，
-但其实是在表达“看一眼就知道是假的”的意思。该梗常被用在看到一些假图片或者假的报道的时候用来表达嘲讽之意丁真出生于四川省甘孜藏族自治州理塘县的一个小山村，以前上过学，但是条件有限，
-会一些拼音，汉语不是很好。工作后，就便继续学习，学汉话、写字。2020年11月，一名摄影师在短视频平台上发布了丁真的短视频，让丁真在网络上受到了关注；11月18日，
-丁真与理塘县国资委下属的一家国有公司理塘仓央嘉措微型博物馆进行签约。成为理塘县的旅游大使，为当地旅游贡献力量；11月25日，为家乡拍摄的宣传片《丁真的世界》正式上线；11月29日，
-用藏语接受央视采访,你的称号有“顶真，理塘王，丁真纯一郎，一眼盯真等，你也可以自己按人设进行微小的改编或者捏造”
-        """
-        msg.content += rs
-        self.toChitchat(msg)
+        self.handlers.dispatch(msg)
+
+    def reloadConfig(self, msg: WxMsg) -> bool:
+        if msg.content == "^更新$":
+            self.config.reload()
+            self.scheduleWeatherReports()  # 订阅的时间可能变了
+            self.LOG.info("已更新")
+        return True
+
+    def resetDzCommand(self, msg: WxMsg) -> bool:
+        self.resetDz(msg)
+        self.sendTextMsg("人设重设成功", msg.roomid if msg.from_group() else msg.sender)
+        self.LOG.info("已重设人设")
+        return True
+
+    def resetDz(self, msg: WxMsg) -> None:
+        """会话换回“^重设人设”对应的人设，之后作为系统提示发给模型"""
+        personas.reset(self.chitchatQuestion(msg)[1])
+
+    def personaCommand(self, msg: WxMsg) -> bool:
+        """“^人设 名字”切换会话人设，“^人设 默认”恢复模型自己的设定，只发“^人设”列出全部人设"""
+        wxid = self.chitchatQuestion(msg)[1]
+        name = msg.content[len("^人设"):].strip()
+        if not name:
+            rsp = f"当前人设：{personas.name(wxid) or '默认'}\n可选人设：{'、'.join(personas.names())}"
+        elif name == "默认":
+            personas.set(wxid, None)
+            rsp = "已恢复默认人设"
+        elif personas.set(wxid, name):
+            rsp = f"已切换人设：{name}"
+        else:
+            rsp = f"没有这个人设：{name}"
+        self.sendTextMsg(rsp, msg.roomid if msg.from_group() else msg.sender)
+        return True
 
     def onMsg(self, msg: WxMsg) -> int:
         try:
-            self.LOG.info(msg)  # 打印信息
-            self.processMsg(msg)
+            if self.acceptMsg(msg):
+                self.processMsg(msg)
         except Exception as e:
             self.LOG.error(e)
 
         return 0
 
     def get_city_code_by_name(self, msg_content: str) -> str:
-        # 读取 Excel 文件
-        df = pd.read_excel("AMap_adcode_citycode.xlsx")
-
-        # 将城市名称作为索引
-        df.set_index("中文名", inplace=True)
-
         # 从消息内容中提取城市名称
-        city_name, _ = process.extractOne(msg_content, df.index)
-
-        # 模糊匹配城市名称
-        matches = process.extract(city_name, df.index, limit=1)
-
-        # 如果匹配度超过阈值，则输出城市代码和区域代码
-        threshold = 80  # 设置匹配阈值
-        if matches[0][1] >= threshold:
-            matched_city_name = matches[0][0]
-
-            # 强制转换为整数，然后再转换为字符串
-            ad_code = str(int(df.loc[matched_city_name, "adcode"]))
-            print(f"找到最匹配的区域代码：{matched_city_name}, 区域代码为：{ad_code}")
-            return ad_code
-        else:
+        city_name = adcode.match_city(msg_content)
+        if city_name is None:
             return "null"
 
+        ad_code = adcode.get_adcode(city_name)
+        self.LOG.info(f"找到最匹配的区域代码：{city_name}, 区域代码为：{ad_code}")
+        return ad_code
+
+    @HANDLER_SECONDS.time(handler="weather_report")
     def weather_report(self, city_name, receivers: List[str]) -> None:
         """模拟发送天气预报"""
 
@@ -291,128 +555,186 @@ class Robot(Job):
         if ad_code == "null":
             error_message = "无法获取城市代码"
             for receiver in receivers:
-                self.sendTextMsg(error_message, receiver)
+                self.sendTextMsg(error_message, receiver, priority=SendPriority.TOOL)
 
             return
 
         # 获取天气 参考高德天气API获取天气。
-        url = f"https://restapi.amap.com/v3/weather/weatherInfo?city={ad_code}&key={self.config.GDTQ_api_key}&extensions=all&output=JSON"
-
-        response = requests.get(url)
-
-        if response.status_code == 200:
-            data = response.json()
-
-            status = data.get("status")
-            if status == "1":
-                forecasts = data.get("forecasts", [])
-                if forecasts:
-                    for forecast in forecasts:
-                        city = forecast.get("city")
-                        province = forecast.get("province")
-                        report_time = forecast.get("reporttime")
-                        message = f"嘿嘿嘿, 理塘王-丁真珍珠给你播报天气来啦!!!\n\n"
-                        message += f"{province} - {city} 的天气信息：\n"
-                        message += f"数据发布时间：{report_time}\n"
-
-                        casts = forecast.get("casts", [])
-                        if casts:
-                            for cast in casts:
-                                date = cast.get("date")
-                                week = cast.get("week")
-                                day_weather = cast.get("dayweather")
-                                night_weather = cast.get("nightweather")
-                                day_temp = cast.get("daytemp")
-                                night_temp = cast.get("nighttemp")
-                                day_wind = cast.get("daywind")
-                                night_wind = cast.get("nightwind")
-                                day_power = cast.get("daypower")
-                                night_power = cast.get("nightpower")
-
-                                message += f"\n日期：{date} 星期{week}\n"
-                                message += f"白天天气：{day_weather}\n"
-                                message += f"夜晚天气：{night_weather}\n"
-                                message += f"白天温度：{day_temp} °C\n"
-                                message += f"夜晚温度：{night_temp} °C\n"
-                                message += f"白天风向：{day_wind}\n"
-                                message += f"夜晚风向：{night_wind}\n"
-                                message += f"白天风力：{day_power}\n"
-                                message += f"夜晚风力：{night_power}\n"
-
-                        message += f"\n看完天气播报记得抽根瑞克冷静一下喔! [呲牙][强]"
-                        for receiver in receivers:
-                            self.sendTextMsg(message, receiver)
-
-                        return
-                else:
-                    error_message = "没有实况天气信息。"
-                    self.LOG.error(error_message)
-
-            else:
-                info = data.get("info", "未知错误")
-                infocode = data.get("infocode", "未知")
-                error_message = f"获取天气失败,错误：{info} (Infocode: {infocode})"
+        try:
+            forecast = self.weather.get_forecast(ad_code)
+        except WeatherError as e:
+            self.LOG.error(str(e))
+            if e.notify:
                 for receiver in receivers:
-                    self.sendTextMsg(error_message, receiver)
-                return
-        else:
-            error_message = "无法获取天气信息。"
-            for receiver in receivers:
-                self.sendTextMsg(error_message, receiver)
+                    self.sendTextMsg(str(e), receiver, priority=SendPriority.TOOL)
+            return
+
+        message = self.formatWeather(forecast)
+        for receiver in receivers:
+            self.sendTextMsg(message, receiver, priority=SendPriority.TOOL)
+
+    @staticmethod
+    def formatWeather(forecast: dict) -> str:
+        city = forecast.get("city")
+        province = forecast.get("province")
+        report_time = forecast.get("reporttime")
+        message = f"嘿嘿嘿, 理塘王-丁真珍珠给你播报天气来啦!!!\n\n"
+        message += f"{province} - {city} 的天气信息：\n"
+        message += f"数据发布时间：{report_time}\n"
+
+        casts = forecast.get("casts", [])
+        if casts:
+            for cast in casts:
+                date = cast.get("date")
+                week = cast.get("week")
+                day_weather = cast.get("dayweather")
+                night_weather = cast.get("nightweather")
+                day_temp = cast.get("daytemp")
+                night_temp = cast.get("nighttemp")
+                day_wind = cast.get("daywind")
+                night_wind = cast.get("nightwind")
+                day_power = cast.get("daypower")
+                night_power = cast.get("nightpower")
+
+                message += f"\n日期：{date} 星期{week}\n"
+                message += f"白天天气：{day_weather}\n"
+                message += f"夜晚天气：{night_weather}\n"
+                message += f"白天温度：{day_temp} °C\n"
+                message += f"夜晚温度：{night_temp} °C\n"
+                message += f"白天风向：{day_wind}\n"
+                message += f"夜晚风向：{night_wind}\n"
+                message += f"白天风力：{day_power}\n"
+                message += f"夜晚风力：{night_power}\n"
+
+        message += f"\n看完天气播报记得抽根瑞克冷静一下喔! [呲牙][强]"
+        return message
 
     def enableRecvMsg(self) -> None:
         self.wcf.enable_recv_msg(self.onMsg)
 
     def enableReceivingMsg(self) -> None:
+        conf = self.config.DISPATCHER
+        self.dispatcher = MsgDispatcher(
+            self.processMsg,
+            workers=conf.get("workers", 8),
+            queue_size=conf.get("queue_size", 32),
+            max_pending=conf.get("max_pending", 64),
+            protected=lambda msg: self.msgPriority(msg) == MsgPriority.PROTECTED,
+        )
+        self.dispatcher.start()
+
+        self.admission = self.createAdmission()
+        QUEUE_DEPTH.set_function(self.dispatcher.pending, queue="dispatcher")
+
         def innerProcessMsg(wcf: Wcf):
             while wcf.is_receiving_msg():
                 try:
                     msg = wcf.get_msg()
-                    self.LOG.info(msg)
-                    self.processMsg(msg)
+                    if self.acceptMsg(msg):
+                        self.admission.put(msg)
                 except Empty:
                     continue  # Empty message
                 except Exception as e:
                     self.LOG.error(f"Receiving message error: {e}")
 
+        def innerDispatchMsg(wcf: Wcf):
+            # 分发线程满载时在这里等待，积压留在入站队列里按策略丢弃
+            while wcf.is_receiving_msg():
+                try:
+                    msg = self.admission.get(timeout=1)
+                    self.dispatcher.submit(self.conversationKey(msg), msg, block=True)
+                except Empty:
+                    continue
+                except Exception as e:
+                    self.LOG.error(f"Dispatching message error: {e}")
+
         self.wcf.enable_receiving_msg()
         Thread(
             target=innerProcessMsg, name="GetMessage", args=(self.wcf,), daemon=True
         ).start()
+        Thread(
+            target=innerDispatchMsg, name="DispatchMessage", args=(self.wcf,), daemon=True
+        ).start()
 
-    def sendDzImg(self, receiver: str, tag="") -> None:
+    def createAdmission(self) -> MsgAdmission:
+        """入站队列，线程和 asyncio 两种运行时共用同样的丢弃、合并策略"""
+        conf = self.config.ADMISSION
+        admission = MsgAdmission(
+            self.msgPriority,
+            self.coalesceKey,
+            max_size=conf.get("max_size", 500),
+            policy=conf.get("policy", "drop_oldest"),
+            coalesce_window=conf.get("coalesce_window", 10),
+        )
+        QUEUE_DEPTH.set_function(admission.qsize, queue="admission")
+        EVENTS.set_function(lambda: admission.dropped, event="admission_dropped")
+        EVENTS.set_function(lambda: admission.coalesced, event="admission_coalesced")
+        return admission
+
+    def acceptMsg(self, msg: WxMsg) -> bool:
+        """收到消息：打印、计数、去重，返回是否需要处理"""
+        # 群里没 @ 机器人的消息量大，日志按配置采样
+        sample = msg.from_group() and not msg.is_at(self.wxid)
+        self.LOG.info(msg, extra={"sample": sample})  # 打印信息
+        MSG_RECEIVED.inc(type=msg.type)
+        if msg.type in (10000, 10002) and msg.from_group():  # 进群、退群、改名等系统消息，群成员可能变了
+            self.members.invalidate(msg.roomid)
+        return not self.isDuplicateMsg(msg)
+
+    def isDuplicateMsg(self, msg: WxMsg) -> bool:
+        """重连或同时开了两种接收方式时，同一条消息可能收到多次"""
+        if msg.id and self.dedup.seen(msg.id):
+            self.LOG.info(f"重复消息，忽略：{msg.id}")
+            return True
+        return False
+
+    def msgPriority(self, msg: WxMsg) -> MsgPriority:
+        """入站队列拥塞时的优先级：群里没被 @ 的消息可以丢弃，被 @、私聊、好友请求不丢"""
+        if msg.from_group():
+            if msg.roomid not in self.config.GROUPS:
+                return MsgPriority.IGNORABLE
+            if msg.is_at(self.wxid):
+                return MsgPriority.PROTECTED
+            return MsgPriority.DROPPABLE
+
+        return MsgPriority.PROTECTED
+
+    def coalesceKey(self, msg: WxMsg):
+        """同一群里内容相同的非 @ 消息视为重复触发"""
+        if msg.from_group() and not msg.is_at(self.wxid):
+            return msg.roomid, msg.content
+        return None
+
+    @staticmethod
+    def conversationKey(msg: WxMsg) -> str:
+        """会话标识：群消息为群 id，私聊为发送者 wxid"""
+        return msg.roomid if msg.from_group() else msg.sender
+
+    @HANDLER_SECONDS.time(handler="sendDzImg")
+    def sendDzImg(self, receiver: str, tag="", priority: SendPriority = SendPriority.INTERACTIVE) -> None:
         """
         发送图片
         :param receiver: 接收人wxid或者群id
-        :param at_list: 要@的wxid, @所有人的wxid为：notify@all
+        :param tag: 图片标签，为空时随机
+        :param priority: 出站队列中的优先级
         """
-        img_dir_path = os.path.join(os.getcwd(), "images")
-        img_dir_paths = os.listdir(img_dir_path)
-        xiao_img_dir_paths = [url for url in img_dir_paths if "笑" in url]
-        ma_img_dir_paths = [url for url in img_dir_paths if "骂" in url]
-        dushu_img_dir_paths = [url for url in img_dir_paths if "读书" in url]
-
-        if tag == "笑":
-            img_path = os.path.join(img_dir_path, random.choice(xiao_img_dir_paths))
-        elif tag == "骂":
-            img_path = os.path.join(img_dir_path, random.choice(ma_img_dir_paths))
-        elif tag == "哭":
-            img_path = os.path.join(img_dir_path, "哭.jpg")
-        elif tag == "读书":
-            img_path = os.path.join(img_dir_path, random.choice(dushu_img_dir_paths))
-        else:
-            img_path = os.path.join(
-                img_dir_path, random.choice(os.listdir(img_dir_path))
-            )
+        img_path = self.images.pick(tag)
+        if img_path is None:
+            self.LOG.error("图片目录里没有图片")
+            return
 
         self.LOG.info(f"To Img {receiver}: {img_path}")
-        self.wcf.send_image(img_path, receiver)
+        if self.imageVariants:
+            img_path = self.imageVariants.get(img_path)
+        self.sendQueue.put("image", img_path, receiver, priority=priority)
 
-    def sendTextMsg(self, msg: str, receiver: str, at_list: str = "") -> None:
+    def sendTextMsg(self, msg: str, receiver: str, at_list: str = "",
+                    priority: SendPriority = SendPriority.INTERACTIVE) -> None:
         """发送消息
         :param msg: 消息字符串
         :param receiver: 接收人wxid或者群id
         :param at_list: 要@的wxid, @所有人的wxid为：notify@all
+        :param priority: 出站队列中的优先级，定时推送用 BROADCAST，不挤占回复
         """
         # msg 中需要有 @ 名单中一样数量的 @
         ats = ""
@@ -423,15 +745,25 @@ class Robot(Job):
                 wxids = at_list.split(",")
                 for wxid in wxids:
                     # 根据 wxid 查找群昵称
-                    ats += f" @{self.wcf.get_alias_in_chatroom(wxid, receiver)}"
+                    ats += f" @{self.members.alias(wxid, receiver)}"
 
         # {msg}{ats} 表示要发送的消息内容后面紧跟@，例如 北京天气情况为：xxx @张三
         if ats == "":
             self.LOG.info(f"To {receiver}: {msg}")
-            self.wcf.send_text(f"{msg}", receiver, at_list)
+            text = f"{msg}"
         else:
             self.LOG.info(f"To {receiver}: {ats}\r{msg}")
-            self.wcf.send_text(f"{ats}\n\n{msg}", receiver, at_list)
+            text = f"{ats}\n\n{msg}"
+
+        self.sendQueue.put("text", text, receiver, at_list, priority)
+
+    def deliverMsg(self, kind: str, content: str, receiver: str, at_list: str = "") -> None:
+        """出站队列实际发送消息"""
+        with timer(SEND_SECONDS, kind=kind):
+            if kind == "image":
+                self.wcf.send_image(content, receiver)
+            else:
+                self.wcf.send_text(content, receiver, at_list)
 
     def getAllContacts(self) -> dict:
         """
@@ -471,6 +803,67 @@ class Robot(Job):
                 f"Hi {nickName[0]}，我自动通过了你的好友请求。", msg.sender
             )
 
+    def scheduleWeatherReports(self) -> None:
+        """按 weather_subscriptions 注册定时天气预报，同一时间点的订阅一起发送；重新加载配置后再调用一次即可"""
+        self.cancelJobs(self.weatherJobs)
+        times = set()
+        for sub in self.config.WEATHER_SUBSCRIPTIONS.get("subscriptions") or []:
+            raw = sub.get("time") or []
+            for t in raw if isinstance(raw, list) else [raw]:
+                at = self._clockTime(t)
+                if at is None:
+                    self.LOG.error(f"天气订阅的时间不合法，应为 \"HH:MM\"：{t}")
+                else:
+                    times.add(at)
+
+        self.weatherJobs = [job for t in sorted(times) for job in self.onEveryTime(t, self.weatherBroadcast, t)]
+
+    @staticmethod
+    def _clockTime(t) -> Optional[str]:
+        """订阅时间统一为 HH:MM，不合法时返回 None
+        YAML 把不带引号的 07:30 当作六十进制整数（450），这里换算回来
+        """
+        if isinstance(t, int) and not isinstance(t, bool) and 0 <= t < 24 * 60:
+            return f"{t // 60:02d}:{t % 60:02d}"
+        m = re.fullmatch(r"(\d{1,2}):(\d{2})", str(t).strip())
+        if m and int(m.group(1)) < 24 and int(m.group(2)) < 60:
+            return f"{int(m.group(1)):02d}:{m.group(2)}"
+        return None
+
+    def _subscriptionTimes(self, sub: dict) -> List[str]:
+        times = sub.get("time") or []
+        return [at for at in map(self._clockTime, times if isinstance(times, list) else [times]) if at]
+
+    def weatherBroadcast(self, at: str) -> None:
+        """发送 at 时间点的天气订阅
+        订阅按区域编码分组：每个城市只查一次天气、只生成一次消息，再依次发给所有订阅者。
+        每次执行时重新读取配置，重载配置后接收人和城市的变化直接生效。
+        """
+        conf = self.config.WEATHER_SUBSCRIPTIONS
+        receivers = {}  # 区域编码 -> {接收人: None}，去重且保持顺序
+        for sub in conf.get("subscriptions") or []:
+            if at not in self._subscriptionTimes(sub):
+                continue
+
+            ad_code = self.get_city_code_by_name(str(sub.get("city", "")))
+            if ad_code == "null":
+                self.LOG.error(f"天气订阅的城市找不到区域代码：{sub.get('city')}")
+                continue
+
+            receivers.setdefault(ad_code, {}).update(dict.fromkeys(sub.get("receivers") or []))
+
+        # 发送速度由出站队列控制
+        for ad_code, rs in receivers.items():
+            try:
+                forecast = self.weather.get_forecast(ad_code)
+            except WeatherError as e:
+                self.LOG.error(f"定时天气 {ad_code} 获取失败：{e}")
+                continue
+
+            message = self.formatWeather(forecast)
+            for r in rs:
+                self.sendTextMsg(message, r, priority=SendPriority.BROADCAST)
+
     def newsReport(self) -> None:
         receivers = self.config.NEWS
         if not receivers:
@@ -478,4 +871,4 @@ class Robot(Job):
 
         news = News().get_important_news()
         for r in receivers:
-            self.sendTextMsg(news, r)
+            self.sendTextMsg(news, r, priority=SendPriority.BROADCAST)
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import time
+from threading import Lock
+from typing import Dict, Iterable
+
+from wcferry import Wcf
+from wcferry.wcf_pb2 import RoomData
+
+
+def _quote(s: str) -> str:
+    return "'" + str(s).replace("'", "''") + "'"
+
+
+class RoomMembers(object):
+    """群成员名片缓存
+    一条 SQL 读出若干个群的 RoomData，再一条 SQL 补齐没设群名片的成员昵称，结果在内存里缓存 ttl 秒。
+    @ 人时直接查内存，不用每个 wxid 调一次 get_alias_in_chatroom。
+    群里有人进出、改群名等系统消息时调用 invalidate，下次用到时重新加载。
+    """
+
+    def __init__(self, wcf: Wcf, ttl: float = 3600) -> None:
+        """
+        :param wcf: Wcf 实例
+        :param ttl: 缓存有效期，秒
+        """
+        self.LOG = logging.getLogger("RoomMembers")
+        self.wcf = wcf
+        self.ttl = ttl
+        self._rooms: Dict[str, tuple] = {}  # 群 id -> (加载时间, {wxid: 群名片或昵称})
+        self._lock = Lock()
+        self.loads = 0
+        self.misses = 0
+
+    def prefetch(self, roomids: Iterable[str]) -> None:
+        """批量加载还没缓存或已过期的群"""
+        now = time.monotonic()
+        with self._lock:
+            stale = [r for r in set(roomids) if r.endswith("@chatroom") and not self._fresh(r, now)]
+        if stale:
+            self._load(stale)
+
+    def get(self, roomid: str) -> Dict[str, str]:
+        """群成员 {wxid: 群名片，没有群名片时为昵称}"""
+        with self._lock:
+            if self._fresh(roomid, time.monotonic()):
+                return self._rooms[roomid][1]
+        self._load([roomid])
+        return self._rooms.get(roomid, (0, {}))[1]
+
+    def alias(self, wxid: str, roomid: str) -> str:
+        """群名片，不在缓存里时（如刚进群）退回 get_alias_in_chatroom"""
+        name = self.get(roomid).get(wxid)
+        if name is None:
+            self.misses += 1
+            name = self.wcf.get_alias_in_chatroom(wxid, roomid)
+            with self._lock:
+                if roomid in self._rooms:
+                    self._rooms[roomid][1][wxid] = name
+        return name
+
+    def invalidate(self, roomid: str) -> None:
+        with self._lock:
+            self._rooms.pop(roomid, None)
+
+    def _fresh(self, roomid: str, now: float) -> bool:
+        entry = self._rooms.get(roomid)
+        return entry is not None and now - entry[0] < self.ttl
+
+    def _load(self, roomids: list) -> None:
+        self.loads += 1
+        rows = self.wcf.query_sql(
+            "MicroMsg.db",
+            f"SELECT ChatRoomName, RoomData FROM ChatRoom WHERE ChatRoomName IN ({','.join(map(_quote, roomids))});"
+        ) or []
+
+        rooms = {r: {} for r in roomids}
+        no_alias = set()
+        for row in rows:
+            bs = row.get("RoomData")
+            if not bs:
+                continue
+            crd = RoomData()
+            crd.ParseFromString(bs)
+            members = rooms[row["ChatRoomName"]] = {}
+            for member in crd.members:
+                members[member.wxid] = member.name
+                if not member.name:
+                    no_alias.add(member.wxid)
+
+        if no_alias:
+            contacts = self.wcf.query_sql(
+                "MicroMsg.db",
+                f"SELECT UserName, NickName FROM Contact WHERE UserName IN ({','.join(map(_quote, no_alias))});"
+            ) or []
+            nicknames = {c["UserName"]: c["NickName"] for c in contacts}
+            for members in rooms.values():
+                for wxid, name in members.items():
+                    if not name:
+                        members[wxid] = nicknames.get(wxid, "")
+
+        now = time.monotonic()
+        with self._lock:
+            for roomid, members in rooms.items():
+                self._rooms[roomid] = (now, members)
+        self.LOG.info(f"加载群成员：{', '.join(f'{r}({len(m)})' for r, m in rooms.items())}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"rooms": len(self._rooms), "loads": self.loads, "misses": self.misses}
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import time
+from collections import deque
+from enum import IntEnum, unique
+from itertools import count
+from threading import Condition, Thread
+from typing import Callable, Dict, Optional, Tuple
+
+from rate_limiter import TokenBuckets
+
+
+@unique
+class SendPriority(IntEnum):
+    INTERACTIVE = 0  # 回复用户的消息
+    TOOL = 1  # 天气查询等功能的输出
+    BROADCAST = 2  # 定时推送、提醒
+
+
+class SendScheduler(object):
+    """出站消息队列
+    所有发送都由一个后台线程依次发出。同一接收人的消息按排队顺序发送，
+    不同接收人之间按队首消息的优先级挑选，定时推送不会挤占回复。
+    按接收人、全局两级令牌桶控制发送速度；同一接收人排队中相邻的、优先级相同的文字（不带 @）合并成一条发送。
+    enable 为 false 时直接在调用线程发送，和原来一样。
+    """
+
+    def __init__(self, send: Callable[[str, str, str, str], None], conf: dict = None) -> None:
+        """
+        :param send: 实际发送的方法 send(kind, content, receiver, at_list)，kind 为 text 或 image
+        :param conf: config.yaml 的 send_scheduler 配置
+        """
+        conf = conf or {}
+        self.LOG = logging.getLogger("SendScheduler")
+        self.send = send
+        self.enable = conf.get("enable", True)
+        self.coalesce = conf.get("coalesce", True)
+        self.max_chars = conf.get("max_chars", 2000)
+        self._receivers = self._buckets(conf.get("receiver"))
+        self._global = self._buckets(conf.get("global"))
+        self._pending: Dict[str, deque] = {}  # 接收人 -> [(优先级, 序号, kind, content, at_list)]，按排队顺序
+        self._count = 0
+        self._seq = count()
+        self._cond = Condition()
+        self.sent = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def _buckets(conf: Optional[dict]) -> Optional[TokenBuckets]:
+        conf = conf or {}
+        return TokenBuckets(conf["rate"], conf.get("burst", 1)) if conf.get("rate") else None
+
+    def start(self) -> None:
+        if self.enable:
+            Thread(target=self._run, name="SendScheduler", daemon=True).start()
+
+    def put(self, kind: str, content: str, receiver: str, at_list: str = "",
+            priority: SendPriority = SendPriority.INTERACTIVE) -> None:
+        """排队发送"""
+        if not self.enable:
+            self._deliver(kind, content, receiver, at_list)
+            return
+
+        with self._cond:
+            self._pending.setdefault(receiver, deque()).append((priority, next(self._seq), kind, content, at_list))
+            self._count += 1
+            self._cond.notify()
+
+    def qsize(self) -> int:
+        return self._count
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    receiver, wait = self._ready(now)
+                    if receiver is not None:
+                        break
+                    self._cond.wait(wait)
+
+                kind, content, at_list = self._pop(receiver)
+                if self._receivers is not None:
+                    self._receivers.take(receiver, now)
+                if self._global is not None:
+                    self._global.take(None, now)
+
+            self._deliver(kind, content, receiver, at_list)
+
+    def _ready(self, now: float) -> Tuple[Optional[str], Optional[float]]:
+        """选出可以发送的接收人中，队首消息优先级最高、排队最久的；都不能发时返回需要等待的秒数"""
+        if self._global is not None:
+            tokens = self._global.available(None, now)
+            if tokens < 1:
+                return None, (1 - tokens) / self._global.rate
+
+        best, wait = None, None
+        for receiver, queue in self._pending.items():
+            if self._receivers is not None:
+                tokens = self._receivers.available(receiver, now)
+                if tokens < 1:
+                    w = (1 - tokens) / self._receivers.rate
+                    wait = w if wait is None else min(wait, w)
+                    continue
+            if best is None or queue[0][:2] < self._pending[best][0][:2]:
+                best = receiver
+        return best, wait
+
+    def _pop(self, receiver: str) -> Tuple[str, str, str]:
+        queue = self._pending[receiver]
+        priority, _, kind, content, at_list = queue.popleft()
+        self._count -= 1
+        if self.coalesce and kind == "text" and not at_list:
+            parts = [content]
+            size = len(content)
+            while (queue and queue[0][0] == priority and queue[0][2] == "text" and not queue[0][4]
+                   and size + len(queue[0][3]) <= self.max_chars):
+                more = queue.popleft()[3]
+                parts.append(more)
+                size += len(more)
+                self._count -= 1
+                self.coalesced += 1
+            content = "\n\n".join(parts)
+        if not queue:
+            del self._pending[receiver]
+        return kind, content, at_list
+
+    def _deliver(self, kind: str, content: str, receiver: str, at_list: str) -> None:
+        try:
+            self.send(kind, content, receiver, at_list)
+            self.sent += 1
+        except Exception as e:
+            self.LOG.error(f"发送给 {receiver} 失败：{e}")